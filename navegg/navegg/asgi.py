@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'navegg.settings')
+# The reads of the sites are answered by async views, see navegg/asgi_urls.py
+os.environ.setdefault('SITES_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -0,0 +1,16 @@
+"""navegg URL Configuration of the ASGI application
+
+The same urls as navegg.urls, with the async reads of the sites. It's the
+ROOT_URLCONF when the SITES_ASYNC_VIEWS environment variable is 1, which
+navegg/asgi.py sets by default.
+"""
+from django.contrib import admin
+from django.urls import path, include
+from sites.views import SitesClassify, metrics
+
+urlpatterns = [
+    path('admin/', admin.site.urls),
+    path('item/', include('sites.async_urls')),
+    path('classify/', SitesClassify.as_view()),
+    path('metrics', metrics),
+]
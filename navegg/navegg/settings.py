@@ -38,11 +38,27 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
-    'sites',
+    'sites.apps.SitesConfig',
 ]
 
+# The JSON of the API is rendered and parsed with orjson when it's installed
+# (sites.renderers), with the json module of DRF otherwise
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'sites.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'sites.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
 
 MIDDLEWARE = [
+    # First, so the time of the requests includes the other middleware
+    'sites.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,7 +68,9 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'navegg.urls'
+# The ASGI application (navegg/asgi.py) sets SITES_ASYNC_VIEWS to 1 unless
+# it's set already, to answer the reads of the sites with async views
+ROOT_URLCONF = 'navegg.asgi_urls' if os.environ.get('SITES_ASYNC_VIEWS') == '1' else 'navegg.urls'
 
 TEMPLATES = [
     {
@@ -76,12 +94,40 @@ WSGI_APPLICATION = 'navegg.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+# SQLite in db.sqlite3 by default. DATABASE_ENGINE=postgresql uses PostgreSQL
+# (with psycopg) set by the DATABASE_* variables below. The connections are
+# kept open for DATABASE_CONN_MAX_AGE seconds, or taken from a pool of
+# DATABASE_POOL_MIN_SIZE to DATABASE_POOL_MAX_SIZE connections in each process
+# when DATABASE_POOL is 1 (requires psycopg[pool])
+
+if os.environ.get('DATABASE_ENGINE', 'sqlite3') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'navegg'),
+            'USER': os.environ.get('DATABASE_USER', 'navegg'),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', 'localhost'),
+            'PORT': os.environ.get('DATABASE_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    if os.environ.get('DATABASE_POOL') == '1':
+        # The pool keeps the connections, they're returned to it after each request
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DATABASE_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.environ.get('DATABASE_POOL_MAX_SIZE', '10')),
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        }
     }
-}
 
 
 # Password validation
@@ -120,4 +166,74 @@ USE_TZ = True
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
-STATIC_URL = '/static/'
\ No newline at end of file
+STATIC_URL = '/static/'
+
+# Sites API
+
+# Default and maximum number of sites returned by one page of GET /item/
+SITES_PAGE_SIZE = 100
+SITES_MAX_PAGE_SIZE = 1000
+
+# Maximum number of operations in one request to POST /item/bulk/
+SITES_BULK_MAX_OPERATIONS = 1000
+
+# Cache of the sites returned by GET /item/ and GET /item/[id]. BACKEND is
+# 'lru' for a cache in the memory of each process, 'django' to use the
+# Django cache in ALIAS, under keys of its own, or None to disable it. The
+# 'lru' cache of each process reads the change log every REFRESH_INTERVAL
+# seconds to drop the sites changed by the other processes, so with several
+# workers a site is stale for at most that long. None reads only the changes
+# made by the process itself
+SITES_CACHE = {
+    'BACKEND': 'lru',
+    'MAX_ENTRIES': 10000,
+    'REFRESH_INTERVAL': 1,
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+}
+
+# Maximum number of changes returned by GET /item/changes and maximum number
+# of seconds it waits for a change
+SITES_CHANGES_PAGE_SIZE = 1000
+SITES_CHANGES_MAX_WAIT = 30
+
+# Seconds a transaction writing the sites may stay open. The change feed and
+# the readers of the change log wait that long for an id missing in the log,
+# a change not committed yet, before reading past it (sites.changes)
+SITES_CHANGES_SAFETY_LAG = 10
+
+# `manage.py prune_changes` removes the changes made SITES_CHANGES_RETENTION_DAYS
+# days ago from the log. The tokens of the feed older than that are answered
+# with 410
+SITES_CHANGES_RETENTION_DAYS = 7
+
+# Seconds between the reads of the change log by the index of the sites in
+# the memory of each process, to find the sites changed by other processes.
+# None reads only the changes made by the process itself
+SITES_INDEX_REFRESH_INTERVAL = 5
+
+# Maximum number of urls classified by one request to POST /classify/
+SITES_CLASSIFY_MAX_URLS = 10000
+
+# Snapshot of the urls and categories of the sites built by `manage.py
+# build_snapshot`, mapped in memory by every process. When the file exists,
+# the lookups of /item/index/ and /classify/ are answered from it instead of
+# the index of each process, and are as up to date as its last build
+SITES_SNAPSHOT_PATH = None
+
+# DELETE /item/[id] and the deletes of POST /item/bulk/ only mark the sites
+# as deleted, which is faster and doesn't lock the links, when it's True.
+# `manage.py purge_sites` removes the sites deleted SITES_PURGE_AFTER_DAYS
+# days ago. When it's False the sites are removed right away
+SITES_SOFT_DELETE = True
+SITES_PURGE_AFTER_DAYS = 7
+
+# Metrics of the requests of each process, exposed at /metrics for
+# Prometheus (sites.metrics). SLOW_REQUEST_SAMPLE_RATE of the requests keep
+# their SQL, and the ones among them taking at least SLOW_REQUEST_SECONDS are
+# logged with it as warnings of the sites.slow_requests logger
+SITES_METRICS = {
+    'ENABLED': True,
+    'SLOW_REQUEST_SECONDS': 1.0,
+    'SLOW_REQUEST_SAMPLE_RATE': 0.1,
+}
@@ -15,8 +15,11 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from sites.views import SitesClassify, metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('item/', include('sites.urls')),
+    path('classify/', SitesClassify.as_view()),
+    path('metrics', metrics),
 ]
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class SitesConfig(AppConfig):
     name = 'sites'
+
+    def ready(self):
+        # Connect the signal receivers, the metrics one before any
+        # connection to the database is opened
+        from sites import metrics, signals
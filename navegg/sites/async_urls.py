@@ -0,0 +1,10 @@
+from django.urls import path
+from rest_framework.urlpatterns import format_suffix_patterns
+from sites import urls, views
+
+# The urls of sites.urls with the async reads of the sites list and detail
+app_name = 'sites'
+urlpatterns = format_suffix_patterns([
+    path('', views.SitesList.as_async_view()),
+    path('<int:pk>', views.SitesDetail.as_async_view()),
+]) + urls.urlpatterns
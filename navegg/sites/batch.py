@@ -0,0 +1,439 @@
+from itertools import islice
+from django.core.exceptions import ImproperlyConfigured
+from sites.models import SiteCategory, SiteCategoryLink, SiteURLLink
+from sites.normalize import url_candidates
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Classification of large batches of visited urls with NumPy, for the jobs
+# reclassifying the logs. A batch of urls is one buffer of bytes, the urls
+# separated by line breaks, normalized and matched with array operations on
+# the whole buffer, and the results are arrays too, with no Python object per
+# url. It gives the same matches as POST /classify/, except that the hosts
+# are lower cased in ASCII only (international hosts should be in punycode)
+#
+#   table = URLTable.build()
+#   for result in classify_batches(urls, table):
+#       url_index, site_id = result.sites()
+#
+# The urls are matched by a 64 bit polynomial hash of the normalized url and
+# of each shorter url it's under, looked up in a hash table of the urls of
+# the sites. NumPy is only required by this module
+
+BATCH_SIZE = 100000
+
+# The hashes are computed modulo 2 ** 64 with the wrapping of uint64, the
+# base is odd so it has an inverse
+HASH_BASE = 0x9E3779B97F4A7C15
+HASH_INVERSE = pow(HASH_BASE, -1, 1 << 64)
+
+SPACE, TAB, CR, NEWLINE = 32, 9, 13, 10
+COLON, SLASH, QUESTION, HASH, AT, DOT = 58, 47, 63, 35, 64, 46
+OPEN_BRACKET, CLOSE_BRACKET = 91, 93
+
+def require_numpy():
+    if np is None:
+        raise ImproperlyConfigured('The batch classification requires NumPy')
+
+# Return the buffer of the urls, which can't contain line breaks, and the
+# start and end of each url in it
+def encode_urls(urls):
+    require_numpy()
+    urls = list(urls)
+    if not urls:
+        return np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    buffer, starts, ends = split_lines('\n'.join(urls).encode())
+    if len(starts) != len(urls):
+        raise ValueError('The urls can not contain line breaks')
+    return buffer, starts, ends
+
+# Return the buffer of the lines and the start and end of each line
+def split_lines(data):
+    require_numpy()
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    breaks = np.flatnonzero(buffer == NEWLINE)
+    starts = np.concatenate([[0], breaks + 1]).astype(np.int64)
+    ends = np.concatenate([breaks, [len(buffer)]]).astype(np.int64)
+    return buffer, starts, ends
+
+# For each range [starts, limits), the first of the sorted positions in it,
+# or the limit
+def first_in(positions, starts, limits):
+    found = np.append(positions, np.iinfo(np.int64).max)[np.searchsorted(positions, starts)]
+    return np.minimum(found, limits)
+
+# For each range [floors, stops), the last of the sorted positions in it, or -1
+def last_in(positions, floors, stops):
+    found = np.concatenate([[-1], positions])[np.searchsorted(positions, stops)]
+    return np.where(found >= floors, found, -1)
+
+# The first and last position of each run of consecutive positions
+def runs(positions):
+    breaks = np.flatnonzero(np.diff(positions) != 1)
+    return positions[np.concatenate([[0], breaks + 1])], positions[np.concatenate([breaks, [-1]])]
+
+# Move the starts of the ranges [starts, stops) past the sorted positions
+# they start at, like a lstrip of the characters at the positions
+def strip_start(positions, starts, stops):
+    if len(positions) == 0:
+        return starts
+    first, last = runs(positions)
+    run = np.maximum(np.searchsorted(first, starts, side='right') - 1, 0)
+    inside = (first[run] <= starts) & (starts <= last[run])
+    return np.minimum(np.where(inside, last[run] + 1, starts), stops)
+
+# Move the stops of the ranges [starts, stops) before the sorted positions
+# they end at, like a rstrip of the characters at the positions
+def strip_stop(positions, starts, stops):
+    if len(positions) == 0:
+        return stops
+    first, last = runs(positions)
+    run = np.maximum(np.searchsorted(first, stops - 1, side='right') - 1, 0)
+    inside = (first[run] <= stops - 1) & (stops - 1 <= last[run])
+    return np.maximum(np.where(inside, first[run], stops), starts)
+
+# Mask of the bytes inside the ranges [starts, stops), which are sorted and
+# don't overlap, built from the lengths of the ranges and the gaps between them
+def ranges_mask(size, starts, stops):
+    bounds = np.concatenate([[0], np.stack([starts, stops], axis=1).ravel(), [size]])
+    inside = np.zeros(len(bounds) - 1, dtype=bool)
+    inside[1::2] = True
+    return np.repeat(inside, np.diff(bounds))
+
+# Normalize the urls in the ranges of the buffer like normalize_url. Return
+# the buffer of the normalized urls with their starts, the ends of their
+# hosts and their ends
+def normalize_buffer(buffer, starts, ends):
+    size = len(buffer)
+    raw_starts, raw_ends = starts, ends
+
+    # Surrounding white space
+    spaces = np.flatnonzero((buffer == SPACE) | (buffer == TAB) | (buffer == CR))
+    starts = strip_start(spaces, starts, ends)
+    ends = strip_stop(spaces, starts, ends)
+
+    # Scheme, then query and fragment
+    colons = np.flatnonzero(buffer == COLON)
+    schemes = colons[colons + 2 < size]
+    schemes = schemes[(buffer[schemes + 1] == SLASH) & (buffer[schemes + 2] == SLASH)]
+    scheme = first_in(schemes, starts, ends)
+    starts = np.where(scheme < ends, scheme + 3, starts)
+    ends = np.minimum(
+        first_in(np.flatnonzero(buffer == QUESTION), starts, ends),
+        first_in(np.flatnonzero(buffer == HASH), starts, ends),
+    )
+
+    # Host, without the user, the port and the trailing dots
+    slashes = np.flatnonzero(buffer == SLASH)
+    host_ends = first_in(slashes, starts, ends)
+    user = last_in(np.flatnonzero(buffer == AT), starts, host_ends)
+    host_starts = np.where(user >= 0, user + 1, starts)
+    ipv6 = (host_starts < host_ends) & (buffer[np.minimum(host_starts, size - 1)] == OPEN_BRACKET)
+    close = first_in(np.flatnonzero(buffer == CLOSE_BRACKET), host_starts, host_ends)
+    host_stops = np.where(
+        ipv6, np.minimum(close + 1, host_ends), first_in(colons, host_starts, host_ends)
+    )
+    host_stops = strip_stop(np.flatnonzero(buffer == DOT), host_starts, host_stops)
+
+    in_host = ranges_mask(size, host_starts, host_stops)
+    upper = in_host & (buffer >= ord('A')) & (buffer <= ord('Z'))
+    buffer = buffer | (upper.view(np.uint8) << 5)
+
+    www = host_stops - host_starts >= 4
+    for offset, character in enumerate(b'www.'):
+        www &= buffer[np.minimum(host_starts + offset, size - 1)] == character
+    host_starts = host_starts + 4 * www
+    keep = ranges_mask(size, host_starts, host_stops)
+
+    # Path without the empty segments: the characters other than slashes and
+    # the slashes after one of them, without the trailing ones
+    ends = strip_stop(slashes, host_ends, ends)
+    in_path = ranges_mask(size, host_ends, ends)
+    is_slash = buffer == SLASH
+    keep |= in_path & ~is_slash
+    kept = in_path[slashes] & ~is_slash[np.maximum(slashes - 1, 0)]
+    keep[slashes[kept]] = True
+
+    kept = np.flatnonzero(keep)
+    return (
+        buffer[kept],
+        np.searchsorted(kept, raw_starts),
+        np.searchsorted(kept, host_stops),
+        np.searchsorted(kept, raw_ends),
+    )
+
+_powers = None
+
+# The powers of the base and of its inverse up to the length
+def hash_powers(length):
+    global _powers
+    if _powers is None or len(_powers[0]) <= length:
+        size = max(length + 1, 2 * len(_powers[0]) if _powers else 0, 1024)
+        with np.errstate(over='ignore'):
+            powers = np.cumprod(np.full(size, HASH_BASE, dtype=np.uint64))
+            inverses = np.cumprod(np.full(size, HASH_INVERSE, dtype=np.uint64))
+        _powers = (
+            np.concatenate([np.ones(1, dtype=np.uint64), powers[:-1]]),
+            np.concatenate([np.ones(1, dtype=np.uint64), inverses[:-1]]),
+        )
+    return _powers
+
+# The index of the url of each byte of the buffer of the normalized urls,
+# which are contiguous
+def byte_owners(starts, ends):
+    return np.repeat(np.arange(len(starts)), ends - starts)
+
+# Prefix sums of the hash of the buffer, each byte weighted by the power of
+# its position
+def hash_prefixes(buffer):
+    powers, _ = hash_powers(len(buffer))
+    with np.errstate(over='ignore'):
+        sums = np.cumsum(buffer.astype(np.uint64) * powers[:len(buffer)], dtype=np.uint64)
+    return np.concatenate([np.zeros(1, dtype=np.uint64), sums])
+
+# The index of the span and the position in the buffer of each byte of the
+# spans, in the order of the spans
+def span_positions(spans_start, spans_end):
+    lengths = spans_end - spans_start
+    owners = np.repeat(np.arange(len(spans_start)), lengths)
+    offsets = np.arange(len(owners)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return owners, spans_start[owners] + offsets
+
+# Hash of the bytes [spans_start, spans_end) of the buffer, which doesn't
+# depend on where they are in it
+def hash_spans(prefixes, spans_start, spans_end):
+    _, inverses = hash_powers(int(spans_start.max(initial=0)))
+    with np.errstate(over='ignore'):
+        hashes = (prefixes[spans_end] - prefixes[spans_start]) * inverses[spans_start]
+    return hashes ^ (spans_end - spans_start).astype(np.uint64)
+
+# Open addressing hash table of distinct hashes, with linear probing. The
+# hashes are spread already, the slot of a hash is its high bits
+class HashTable:
+
+    def __init__(self, hashes):
+        bits = max(int(len(hashes) * 2).bit_length(), 4)
+        self.shift = np.uint64(64 - bits)
+        self.mask = (1 << bits) - 1
+        self.slots = np.zeros(1 << bits, dtype=np.uint64)
+        # Index of the hash in each slot, -1 when the slot is free
+        self.values = np.full(1 << bits, -1, dtype=np.int64)
+
+        # All the hashes are inserted at once, the ones whose slot is taken
+        # by another try the next slot
+        pending = np.arange(len(hashes))
+        slots = self.home(hashes)
+        while len(pending):
+            free = self.values[slots] == -1
+            _, first = np.unique(slots[free], return_index=True)
+            placed = np.flatnonzero(free)[first]
+            self.values[slots[placed]] = pending[placed]
+            self.slots[slots[placed]] = hashes[pending[placed]]
+            left = np.ones(len(pending), dtype=bool)
+            left[placed] = False
+            pending, slots = pending[left], (slots[left] + 1) & self.mask
+
+    def home(self, hashes):
+        return (hashes >> self.shift).astype(np.int64)
+
+    # Return the index of each hash in the hashes of the table, or -1
+    def lookup(self, hashes):
+        result = np.full(len(hashes), -1, dtype=np.int64)
+        pending = np.arange(len(hashes))
+        slots = self.home(hashes)
+        while len(pending):
+            values = self.values[slots]
+            found = (values >= 0) & (self.slots[slots] == hashes[pending])
+            result[pending[found]] = values[found]
+            # The probing stops at a free slot
+            left = (values >= 0) & ~found
+            pending, slots = pending[left], (slots[left] + 1) & self.mask
+        return result
+
+# Return the rows of the values of a CSR table (offsets, values) for each of
+# the rows, as (index in rows, value) arrays
+def expand(offsets, values, rows):
+    starts = offsets[rows]
+    counts = offsets[rows + 1] - starts
+    owners = np.repeat(np.arange(len(rows)), counts)
+    positions = (
+        np.arange(counts.sum())
+        - np.repeat(np.cumsum(counts) - counts, counts)
+        + np.repeat(starts, counts)
+    )
+    return owners, values[positions]
+
+# Return the (offsets, values) of the CSR table of the distinct pairs grouped
+# by the first value, for the sorted first values in keys
+def group(keys, firsts, seconds):
+    pairs = np.unique(np.stack([firsts.astype(np.int64), seconds.astype(np.int64)]), axis=1)
+    offsets = np.append(np.searchsorted(pairs[0], keys), pairs.shape[1]).astype(np.int64)
+    return offsets, pairs[1].astype(np.int32)
+
+# The urls of the active sites compiled to sorted arrays: the hashes of the
+# normalized urls with the ids of their sites, and the sites with the ids of
+# their categories
+class URLTable:
+
+    def __init__(self, url_links, category_links, categories):
+        require_numpy()
+        buffer, starts, ends = encode_urls(url for url, _ in url_links)
+        buffer, starts, _, ends = normalize_buffer(buffer, starts, ends)
+        hashes = hash_spans(hash_prefixes(buffer), starts, ends)
+
+        # The urls with the same normalized form are one key
+        self.hashes, first, key_rows = np.unique(hashes, return_index=True, return_inverse=True)
+        self.keys = np.array(
+            [buffer[starts[row]:ends[row]].tobytes().decode() for row in first], dtype=str
+        )
+        normalized = {buffer[start:end].tobytes() for start, end in zip(starts, ends)}
+        if len(normalized) != len(self.keys):
+            raise ValueError('Two urls of the sites have the same hash')
+        # The bytes of the keys, to check the urls matched by their hash
+        key_lengths = ends[first] - starts[first]
+        self.key_starts = np.concatenate([[0], np.cumsum(key_lengths)]).astype(np.int64)
+        self.key_bytes = buffer[span_positions(starts[first], ends[first])[1]]
+        self.table = HashTable(self.hashes)
+        url_sites = np.fromiter((site_id for _, site_id in url_links), np.int32, len(url_links))
+        self.key_offsets, self.key_sites = group(np.arange(len(self.keys)), key_rows, url_sites)
+
+        self.site_ids = np.unique(url_sites)
+        link_sites = np.fromiter((site_id for site_id, _ in category_links), np.int32, len(category_links))
+        link_categories = np.fromiter(
+            (category_id for _, category_id in category_links), np.int32, len(category_links)
+        )
+        known = np.isin(link_sites, self.site_ids)
+        self.site_offsets, self.site_categories = group(
+            self.site_ids, link_sites[known], link_categories[known]
+        )
+
+        categories = sorted(categories)
+        self.category_ids = np.array([category_id for category_id, _ in categories], dtype=np.int32)
+        self.category_names = np.array([name for _, name in categories], dtype=str)
+
+    # Compile the table from the urls and categories of the active sites
+    @classmethod
+    def build(cls):
+        url_links = list(
+            SiteURLLink.objects.active()
+            .values_list('siteurl__description', 'sites_id')
+        )
+        category_links = list(
+            SiteCategoryLink.objects.active()
+            .values_list('sites_id', 'sitecategory_id')
+        )
+        categories = list(SiteCategory.objects.values_list('id', 'description'))
+        return cls(url_links, category_links, categories)
+
+    # Return the index in keys of the longest url each url is under, or -1.
+    # The candidates of a url are the url, the url cut at each slash and the
+    # host without each of its first labels, all looked up at once
+    def match(self, buffer, starts, ends):
+        buffer, starts, host_ends, ends = normalize_buffer(buffer, starts, ends)
+        count = len(starts)
+        result = np.full(count, -1, dtype=np.int64)
+        if len(self.hashes) == 0 or len(buffer) == 0:
+            return result
+
+        owners = byte_owners(starts, ends)
+        slashes = np.flatnonzero(buffer == SLASH)
+        dots = np.flatnonzero(buffer == DOT)
+        dot_owners = owners[dots]
+        in_host = dots + 1 < host_ends[dot_owners]
+        dots, dot_owners = dots[in_host], dot_owners[in_host]
+        slash_owners = owners[slashes]
+
+        urls = np.concatenate([np.arange(count), slash_owners, dot_owners])
+        spans_start = np.concatenate([starts, starts[slash_owners], dots + 1])
+        spans_end = np.concatenate([ends, slashes, host_ends[dot_owners]])
+        nonempty = spans_end > spans_start
+        urls, spans_start, spans_end = urls[nonempty], spans_start[nonempty], spans_end[nonempty]
+
+        hashes = hash_spans(hash_prefixes(buffer), spans_start, spans_end)
+        keys = self.table.lookup(hashes)
+        found = np.flatnonzero(keys >= 0)
+        # A url with the hash of a key is only a match with its bytes
+        same = self.same_bytes(buffer, spans_start[found], spans_end[found], keys[found])
+        found = found[same]
+
+        # The longest candidate found of each url wins, the candidates of a
+        # url have different lengths
+        urls, lengths, keys = urls[found], (spans_end - spans_start)[found], keys[found]
+        longest = np.zeros(count, dtype=lengths.dtype)
+        np.maximum.at(longest, urls, lengths)
+        best = lengths == longest[urls]
+        result[urls[best]] = keys[best]
+        return result
+
+    # Return whether each span of the buffer has the bytes of its key
+    def same_bytes(self, buffer, spans_start, spans_end, keys):
+        same = spans_end - spans_start == self.key_starts[keys + 1] - self.key_starts[keys]
+        rows = np.flatnonzero(same)
+        owners, positions = span_positions(spans_start[rows], spans_end[rows])
+        key_positions = positions - spans_start[rows][owners] + self.key_starts[keys[rows]][owners]
+        same[rows[owners[buffer[positions] != self.key_bytes[key_positions]]]] = False
+        return same
+
+    def classify(self, urls):
+        return Classification(self, self.match(*encode_urls(urls)))
+
+    # Classify the lines of a buffer of bytes, like a chunk of a log file
+    def classify_lines(self, data):
+        if data.endswith(b'\n'):
+            data = data[:-1]
+        return Classification(self, self.match(*split_lines(data)))
+
+# Result of the classification of a batch of urls, as arrays
+class Classification:
+
+    def __init__(self, table, match):
+        self.table = table
+        # Index of the matched url of each url in table.keys, or -1
+        self.match = match
+
+    def __len__(self):
+        return len(self.match)
+
+    # The matched url of each url, empty when there's no match
+    def matched_urls(self):
+        keys = self.table.keys
+        if len(keys) == 0:
+            return np.full(len(self.match), '', dtype=str)
+        return np.where(self.match >= 0, keys[np.maximum(self.match, 0)], '')
+
+    # The (index of the url, site id) pairs of the matched sites
+    def sites(self):
+        matched = np.flatnonzero(self.match >= 0)
+        owners, site_ids = expand(self.table.key_offsets, self.table.key_sites, self.match[matched])
+        return matched[owners], site_ids
+
+    # The distinct (index of the url, category id) pairs of the matched sites
+    def categories(self):
+        url_rows, site_ids = self.sites()
+        site_rows = np.searchsorted(self.table.site_ids, site_ids)
+        owners, category_ids = expand(self.table.site_offsets, self.table.site_categories, site_rows)
+        pairs = np.unique(np.stack([url_rows[owners], category_ids.astype(np.int64)]), axis=1)
+        return pairs[0], pairs[1].astype(np.int32)
+
+    # The descriptions of the category ids
+    def category_names(self, category_ids):
+        return self.table.category_names[np.searchsorted(self.table.category_ids, category_ids)]
+
+# Classify the urls of an iterable in batches of batch_size urls, yielding
+# the Classification of each batch
+def classify_batches(urls, table=None, batch_size=BATCH_SIZE):
+    table = table if table is not None else URLTable.build()
+    urls = iter(urls)
+    while True:
+        batch = list(islice(urls, batch_size))
+        if not batch:
+            return
+        yield table.classify(batch)
+
+# Reference classification of a single url, one dictionary lookup per
+# candidate url, used to check and measure the batch classification
+def classify_one(keys, url):
+    return next((candidate for candidate in url_candidates(url) if candidate in keys), None)
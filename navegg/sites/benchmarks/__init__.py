@@ -0,0 +1,13 @@
+# Benchmarks of the sites, run by the benchmark_* management commands.
+# components has the ones of single code paths, comparing the fast paths
+# with the default ones, and suite the benchmark suite of the API and the
+# import on synthetic catalogs, with the comparison against a baseline.
+# The commands run them on the test database of database
+from sites.benchmarks.catalog import synthetic_site, write_catalog
+from sites.benchmarks.components import (
+    benchmark_asgi, benchmark_classify, benchmark_json, benchmark_metrics, benchmark_serialize,
+    create_synthetic_sites, latency_percentiles, measure, synthetic_representation,
+    synthetic_urls,
+)
+from sites.benchmarks.database import benchmark_database, truncate_sites
+from sites.benchmarks.suite import compare_results, run_suite
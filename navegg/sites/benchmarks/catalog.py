@@ -0,0 +1,47 @@
+import csv
+import random
+from itertools import accumulate
+
+# Synthetic catalogs of sites in the CSV format of the import (see
+# sites.parsing), with a fan-out like the one of the real data: most sites
+# have one or two urls and a few have many, some urls are listed by several
+# sites and a few categories are in most of the sites. The same seed gives
+# the same catalog
+
+CATEGORIES = 500
+# Number of urls of the sites and the weight of each number
+URL_COUNTS = (1, 2, 3, 4, 6, 10)
+URL_WEIGHTS = (40, 30, 15, 8, 5, 2)
+# Number of categories of the sites and the weight of each number
+CATEGORY_COUNTS = (1, 2, 3, 5)
+CATEGORY_WEIGHTS = (35, 35, 20, 10)
+# The categories are picked with the weight 1 / rank, like the words of a text
+CATEGORY_CUM_WEIGHTS = tuple(accumulate(1 / rank for rank in range(1, CATEGORIES + 1)))
+
+# Return the name, urls, categories and active of the synthetic site
+def synthetic_site(index, generator, sites):
+    urls = [f'site{index}.com']
+    for section in range(generator.choices(URL_COUNTS, URL_WEIGHTS)[0] - 1):
+        urls.append(f'site{index}.com/section{section}')
+    # One site in 20 also lists the url of one of the hosts shared by them
+    if generator.random() < 0.05:
+        urls.append(f'shared{generator.randrange(sites // 100 + 1)}.com')
+    categories = {
+        f'category{category}' for category in generator.choices(
+            range(CATEGORIES), cum_weights=CATEGORY_CUM_WEIGHTS,
+            k=generator.choices(CATEGORY_COUNTS, CATEGORY_WEIGHTS)[0],
+        )
+    }
+    return f'Synthetic site {index}', urls, sorted(categories), generator.random() < 0.9
+
+# Write a catalog of the number of sites to the CSV file
+def write_catalog(path, sites, seed=0):
+    generator = random.Random(seed)
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file, quoting=csv.QUOTE_ALL)
+        writer.writerow(['name', 'urls', 'categories', 'status'])
+        for index in range(sites):
+            name, urls, categories, active = synthetic_site(index, generator, sites)
+            writer.writerow(
+                [name, ';'.join(urls), ';'.join(categories), 'active' if active else 'inactive']
+            )
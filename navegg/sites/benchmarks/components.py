@@ -0,0 +1,365 @@
+import asyncio
+import gc
+import random
+import statistics
+import time
+from collections import Counter
+from io import BytesIO
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, transaction
+from django.http import HttpResponse
+from django.test import Client, RequestFactory
+from django.test.utils import override_settings
+from django.urls import resolve
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from sites.batch import URLTable, classify_one
+from sites.metrics import MetricsMiddleware, registry
+from sites.models import Sites, SiteCategory, SiteCategoryLink, SiteURL, SiteURLLink
+from sites.renderers import (
+    ColumnarRenderer, FastJSONParser, FastJSONRenderer, MessagePackRenderer, msgpack, orjson,
+)
+from sites.representation import represent_queryset
+from sites.serializers import SitesSerializer
+
+# Benchmarks of the code paths that are too slow to measure in the tests.
+# They use synthetic data, the ones reading the database write it in a
+# transaction which is rolled back at the end, on the test database of
+# benchmark_database when run by the commands
+
+# Return the shortest time in seconds of repeat runs of the function, without
+# the garbage collector like timeit
+def measure(function, repeat=3):
+    best = None
+    for _ in range(repeat):
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            function()
+            seconds = time.perf_counter() - start
+        finally:
+            if enabled:
+                gc.enable()
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+# Return the median and the 99th percentile of the latencies in milliseconds
+def latency_percentiles(latencies):
+    latencies = sorted(latencies)
+    return {
+        'p50_ms': round(statistics.median(latencies) * 1000, 2),
+        'p99_ms': round(latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000, 2),
+    }
+
+# Return site_urls urls of synthetic sites, with the links to the sites and
+# categories, and urls visited under them (or under no site)
+def synthetic_urls(site_urls, visited, seed=0):
+    generator = random.Random(seed)
+    url_links = []
+    for index in range(site_urls):
+        url = f'site{index}.com'
+        if index % 3 == 0:
+            url += f'/section{index % 7}'
+        url_links.append((url, index + 1))
+    category_links = [(index + 1, index % 50 + 1) for index in range(site_urls)]
+    categories = [(index + 1, f'category{index}') for index in range(50)]
+
+    urls = [
+        f'https://www.site{generator.randrange(site_urls * 2)}.com'
+        f'/section{generator.randrange(9)}/page{generator.randrange(1000)}?ref={index}'
+        for index in range(visited)
+    ]
+    return (url_links, category_links, categories), urls
+
+# Classify the visited urls with the batch classification and with a loop
+# classifying one url at a time, and return the urls per second of each
+def benchmark_classify(site_urls=100000, visited=1000000, batch_size=100000, seed=0):
+    links, urls = synthetic_urls(site_urls, visited, seed)
+
+    start = time.perf_counter()
+    table = URLTable(*links)
+    compiled = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matches = []
+    for offset in range(0, len(urls), batch_size):
+        result = table.classify(urls[offset:offset + batch_size])
+        matches.extend(result.matched_urls().tolist())
+    batch = time.perf_counter() - start
+
+    keys = set(table.keys.tolist())
+    start = time.perf_counter()
+    expected = [classify_one(keys, url) or '' for url in urls]
+    loop = time.perf_counter() - start
+
+    return {
+        'site_urls': site_urls,
+        'visited': visited,
+        'compile_seconds': round(compiled, 3),
+        'batch_urls_per_second': round(visited / batch),
+        'loop_urls_per_second': round(visited / loop),
+        'speedup': round(loop / batch, 2),
+        'matched': sum(1 for match in matches if match),
+        'same_matches': matches == expected,
+    }
+
+# Create synthetic sites with two urls and two of 50 categories each
+def create_synthetic_sites(sites):
+    Sites.objects.bulk_create(
+        [Sites(name=f'Synthetic site {index}') for index in range(sites)], batch_size=1000
+    )
+    site_ids = list(
+        Sites.objects.filter(name__startswith='Synthetic site ').order_by('id')
+        .values_list('id', flat=True)
+    )
+    SiteURL.objects.bulk_create([
+        SiteURL.objects.build(f'synthetic{index}.com{path}')
+        for index in range(sites) for path in ('', '/news')
+    ], batch_size=1000)
+    SiteCategory.objects.bulk_create(
+        [SiteCategory(description=f'synthetic{index}') for index in range(50)], batch_size=1000
+    )
+    url_ids = list(
+        SiteURL.objects.filter(description__startswith='synthetic').order_by('id')
+        .values_list('id', flat=True)
+    )
+    category_ids = list(
+        SiteCategory.objects.filter(description__startswith='synthetic').values_list('id', flat=True)
+    )
+    SiteURLLink.objects.bulk_create([
+        SiteURLLink(sites_id=site_id, siteurl_id=url_ids[index * 2 + offset])
+        for index, site_id in enumerate(site_ids) for offset in (0, 1)
+    ], batch_size=1000)
+    SiteCategoryLink.objects.bulk_create([
+        SiteCategoryLink(sites_id=site_id, sitecategory_id=category_ids[(index + offset) % 50])
+        for index, site_id in enumerate(site_ids) for offset in (0, 7)
+    ], batch_size=1000)
+    return site_ids
+
+# Render the sites to JSON with SitesSerializer and with the representation
+# built from rows of values, and return the seconds taken by each
+def benchmark_serialize(sites=10000, chunk_size=1000):
+    renderer = JSONRenderer()
+    with transaction.atomic():
+        site_ids = create_synthetic_sites(sites)
+        queryset = Sites.objects.filter(id__gte=site_ids[0], id__lte=site_ids[-1]).order_by('id')
+
+        def chunks():
+            for offset in range(0, len(site_ids), chunk_size):
+                yield queryset.filter(id__gte=site_ids[offset])[:chunk_size]
+
+        start = time.perf_counter()
+        expected = [
+            renderer.render(SitesSerializer(chunk.prefetch_related('url', 'category'), many=True).data)
+            for chunk in chunks()
+        ]
+        serializer = time.perf_counter() - start
+
+        start = time.perf_counter()
+        rendered = [renderer.render(represent_queryset(chunk)) for chunk in chunks()]
+        fast = time.perf_counter() - start
+
+        transaction.set_rollback(True)
+
+    return {
+        'sites': sites,
+        'serializer_seconds': round(serializer, 3),
+        'representation_seconds': round(fast, 3),
+        'speedup': round(serializer / fast, 2),
+        'same_output': rendered == expected,
+    }
+
+# Return sites in the format of SitesSerializer, with two urls and two
+# categories each, of 50 categories
+def synthetic_representation(sites):
+    return [
+        {
+            'id': index + 1,
+            'name': f'Synthetic site {index} ação',
+            'active': index % 5 != 0,
+            'url': [
+                {'id': index * 2 + 1, 'description': f'synthetic{index}.com'},
+                {'id': index * 2 + 2, 'description': f'synthetic{index}.com/news'},
+            ],
+            'category': [
+                {'id': index % 50 + 1, 'description': f'category{index % 50}'},
+                {'id': (index + 7) % 50 + 1, 'description': f'category{(index + 7) % 50}'},
+            ],
+        }
+        for index in range(sites)
+    ]
+
+# Render a list of sites and parse it back with DRF's JSON renderer and
+# parser and with the ones of sites.renderers, and return the best of the
+# seconds taken by repeat runs, with the size and decoding time of the
+# MessagePack, when the msgpack package is installed, and columnar formats
+def benchmark_json(sites=10000, repeat=3):
+    data = synthetic_representation(sites)
+    expected = JSONRenderer().render(data)
+    render = measure(lambda: JSONRenderer().render(data), repeat)
+    fast_render = measure(lambda: FastJSONRenderer().render(data), repeat)
+    parse = measure(lambda: JSONParser().parse(BytesIO(expected)), repeat)
+    fast_parse = measure(lambda: FastJSONParser().parse(BytesIO(expected)), repeat)
+    rendered = FastJSONRenderer().render(data)
+    parsed = FastJSONParser().parse(BytesIO(rendered))
+
+    # The binary and columnar formats of the lists of sites
+    columnar = ColumnarRenderer().render(data)
+    parse_columnar = measure(lambda: FastJSONParser().parse(BytesIO(columnar)), repeat)
+    same_output = rendered == expected and parsed == data
+    packing = {}
+    if msgpack is not None:
+        packed = MessagePackRenderer().render(data)
+        unpack = measure(lambda: msgpack.unpackb(packed), repeat)
+        packing = {'msgpack_bytes': len(packed), 'msgpack_unpack_seconds': round(unpack, 4)}
+        same_output = same_output and msgpack.unpackb(packed) == data
+
+    return {
+        'sites': sites,
+        'bytes': len(expected),
+        'orjson': orjson is not None,
+        'render_seconds': round(render, 4),
+        'fast_render_seconds': round(fast_render, 4),
+        'render_speedup': round(render / fast_render, 2),
+        'parse_seconds': round(parse, 4),
+        'fast_parse_seconds': round(fast_parse, 4),
+        'parse_speedup': round(parse / fast_parse, 2),
+        **packing,
+        'columnar_bytes': len(columnar),
+        'columnar_parse_seconds': round(parse_columnar, 4),
+        'same_output': same_output,
+    }
+
+# Send a GET request to the ASGI application, like a client reading the body
+# in client_delay seconds, and return the status and the seconds it took
+async def asgi_get(application, url, client_delay=0):
+    path, _, query = url.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': query.encode(), 'headers': [(b'host', b'testserver')],
+        'server': ('testserver', 80), 'client': ('127.0.0.1', 50000),
+    }
+    received = False
+    response_status = None
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # The client doesn't disconnect
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal response_status
+        if message['type'] == 'http.response.start':
+            response_status = message['status']
+        elif client_delay:
+            await asyncio.sleep(client_delay)
+
+    start = time.perf_counter()
+    await application(scope, receive, send)
+    return response_status, time.perf_counter() - start
+
+# Run clients concurrent clients sending requests each to the ASGI application
+# with the urls, and return the latencies and the number of
+# responses of each status
+async def load(application, urls, clients, requests, client_delay):
+    generator = random.Random(0)
+    latencies = []
+    statuses = Counter()
+
+    async def client():
+        for _ in range(requests):
+            response_status, seconds = await asgi_get(application, generator.choice(urls), client_delay)
+            latencies.append(seconds)
+            statuses[response_status] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return latencies, statuses, time.perf_counter() - start
+
+# Load the ASGI application with clients concurrent clients reading pages of
+# sites and sites, with the sync DRF views and with the async views, and
+# return the latencies of each. The data is written in a transaction rolled
+# back at the end, used by all the requests
+def benchmark_asgi(clients=1000, requests=5, sites=1000, client_delay=0, cache=True):
+    application = get_asgi_application()
+    results = []
+    # The requests run in this thread's transaction, which the connections
+    # closed at the start and end of the requests would end
+    request_started.disconnect(close_old_connections)
+    request_finished.disconnect(close_old_connections)
+    try:
+        with transaction.atomic():
+            site_ids = create_synthetic_sites(sites)
+            urls = [f'/item/?page_size=100&cursor={site_ids[0] + offset - 1}'
+                    for offset in range(0, sites, 100)]
+            urls += [f'/item/{site_id}' for site_id in site_ids]
+            cache_setting = {'BACKEND': 'lru', 'MAX_ENTRIES': 100000} if cache else {'BACKEND': None}
+
+            for urlconf in ('navegg.urls', 'navegg.asgi_urls'):
+                # The host of the requests is only allowed by the test runner
+                with override_settings(ROOT_URLCONF=urlconf, SITES_CACHE=cache_setting,
+                                       ALLOWED_HOSTS=['testserver']):
+                    latencies, statuses, seconds = async_to_sync(load)(
+                        application, urls, clients, requests, client_delay
+                    )
+                results.append({
+                    'views': 'async' if urlconf == 'navegg.asgi_urls' else 'sync',
+                    'clients': clients,
+                    'requests': len(latencies),
+                    'errors': len(latencies) - statuses[200],
+                    # Responses by status, the latencies of errors measure nothing
+                    'statuses': {str(code): count for code, count in sorted(statuses.items())},
+                    'requests_per_second': round(len(latencies) / seconds),
+                    **latency_percentiles(latencies),
+                })
+            transaction.set_rollback(True)
+    finally:
+        request_started.connect(close_old_connections)
+        request_finished.connect(close_old_connections)
+    return results
+
+# Return the time added by MetricsMiddleware around a view answering right
+# away, and the time of the requests of the views with the cache without the
+# middleware, which it adds to. The difference of the requests with and
+# without the middleware is smaller than their noise, so its own time is
+# measured alone
+def benchmark_metrics(requests=10000, sites=100, repeat=5):
+    results = []
+    with transaction.atomic():
+        site_ids = create_synthetic_sites(sites)
+        for url in (f'/item/{site_ids[0]}', '/item/?page_size=10'):
+            middleware_classes = [
+                name for name in settings.MIDDLEWARE if name != 'sites.metrics.MetricsMiddleware'
+            ]
+            with override_settings(MIDDLEWARE=middleware_classes, ALLOWED_HOSTS=['testserver']):
+                client = Client()
+                content = client.get(url).content
+                request_seconds = measure(
+                    lambda: [client.get(url) for _ in range(requests // 10)], repeat
+                ) / (requests // 10)
+
+            request = RequestFactory().get(url)
+            request.resolver_match = resolve(request.path)
+            view = lambda request: HttpResponse(content)
+            middleware = MetricsMiddleware(view)
+            seconds = (
+                measure(lambda: [middleware(request) for _ in range(requests)], repeat)
+                - measure(lambda: [view(request) for _ in range(requests)], repeat)
+            ) / requests
+            results.append({
+                'url': url,
+                'middleware_us': round(seconds * 1e6, 1),
+                'request_us': round(request_seconds * 1e6, 1),
+                'overhead_percent': round(seconds / request_seconds * 100, 2),
+            })
+        transaction.set_rollback(True)
+    registry.clear()
+    return results
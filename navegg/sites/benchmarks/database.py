@@ -0,0 +1,46 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from django.apps import apps
+from django.core.management.color import no_style
+from django.db import connection
+from django.test.utils import setup_databases, teardown_databases
+from sites.cache import get_cache
+from sites.index import get_index
+
+# Database of the benchmarks, a test database created like the one of the
+# tests so the synthetic sites never reach the data of the site. SQLite
+# tests run in memory, which leaves out the writes to the disk, so without
+# a NAME in its TEST settings the database is a file in a temporary
+# directory
+@contextmanager
+def benchmark_database():
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    old_name = test_settings.get('NAME')
+    with tempfile.TemporaryDirectory() as directory:
+        if connection.vendor == 'sqlite' and not old_name:
+            test_settings['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+        try:
+            old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+            try:
+                yield
+            finally:
+                teardown_databases(old_config, verbosity=0)
+        finally:
+            test_settings['NAME'] = old_name
+
+# Empty the tables of the sites after a benchmark and drop the sites cached
+# by the process. The sequences go on, so the positions in the log of the
+# changes kept by the cache and the index stay valid
+def truncate_sites():
+    tables = [
+        model._meta.db_table
+        for model in apps.get_app_config('sites').get_models(include_auto_created=True)
+    ]
+    connection.ops.execute_sql_flush(
+        connection.ops.sql_flush(no_style(), tables, allow_cascade=True)
+    )
+    cache = get_cache()
+    if cache is not None:
+        cache.clear()
+    get_index().clear()
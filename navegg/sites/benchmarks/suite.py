@@ -0,0 +1,184 @@
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from django.db import connection
+from django.db.models import Max, Min
+from django.test import Client
+from django.test.utils import override_settings
+from sites.benchmarks.catalog import synthetic_site, write_catalog
+from sites.benchmarks.components import latency_percentiles
+from sites.benchmarks.database import truncate_sites
+from sites.loader import BulkLoader
+from sites.metrics import RequestRecord
+from sites.models import Sites
+from sites.parsing import read_records
+
+# Benchmark suite of the API and of the import, run on synthetic catalogs of
+# sites. Each catalog is written to a CSV file and loaded like setup.py does,
+# then the endpoints are called in the process with random ids of the
+# catalog. The writes are committed like on the site and the tables of the
+# sites are emptied after each catalog, so the suite runs on the database of
+# benchmark_database, never on the one of the site. The results are a dict that can be saved as JSON and compared with the
+# results of an earlier run, the baseline
+
+RESULTS_VERSION = 1
+# Requests sent to each endpoint before the measured ones, left out of the
+# results so the first queries and imports don't land in the p99
+WARMUP_REQUESTS = 10
+
+# Peak resident memory of the process in megabytes, it never goes down so
+# with several catalogs in the same run it's the peak of the largest one
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+# Return the latencies, queries and errors of the requests, each request is a
+# function calling the client and returning the response. The first
+# WARMUP_REQUESTS are not measured
+def measure_requests(requests, expected_status):
+    for request in requests[:WARMUP_REQUESTS]:
+        request()
+    latencies = []
+    queries = 0
+    errors = 0
+    for request in requests[WARMUP_REQUESTS:]:
+        record = RequestRecord(keep_statements=False)
+        with connection.execute_wrapper(record):
+            start = time.perf_counter()
+            response = request()
+            latencies.append(time.perf_counter() - start)
+        queries += record.queries
+        errors += response.status_code != expected_status
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        **latency_percentiles(latencies),
+        'queries_per_request': round(queries / len(latencies), 2),
+    }
+
+# Load the catalog with BulkLoader, like setup.py, and return its results
+def benchmark_import(path, sites, chunk_size):
+    record = RequestRecord(keep_statements=False)
+    loader = BulkLoader(chunk_size=chunk_size, log=lambda message: None)
+    with connection.execute_wrapper(record):
+        start = time.perf_counter()
+        loader.load(read_records(path))
+        seconds = time.perf_counter() - start
+    return {
+        'rows': loader.rows,
+        'created': loader.created,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(sites / seconds),
+        'queries_per_1000_rows': round(record.queries * 1000 / sites, 2),
+    }
+
+# Call the read and write endpoints requests times each with random sites of
+# the catalog and return their results by endpoint
+def benchmark_endpoints(requests, generator, page_size=100):
+    client = Client()
+    bounds = Sites.objects.aggregate(first_id=Min('id'), last_id=Max('id'))
+    first_id, last_id = bounds['first_id'], bounds['last_id']
+    random_id = lambda: generator.randint(first_id, last_id)
+    total = WARMUP_REQUESTS + requests
+
+    def site_body(index):
+        name, urls, categories, _ = synthetic_site(index, generator, last_id - first_id + 1)
+        return {
+            'name': f'Benchmark {name}',
+            'url': [{'description': url} for url in urls],
+            'category': [{'description': category} for category in categories],
+        }
+
+    return {
+        'list': measure_requests([
+            lambda cursor=random_id(): client.get(f'/item/?page_size={page_size}&cursor={cursor}')
+            for _ in range(total)
+        ], 200),
+        'detail': measure_requests([
+            lambda pk=random_id(): client.get(f'/item/{pk}') for _ in range(total)
+        ], 200),
+        'create': measure_requests([
+            lambda body=site_body(index): client.post('/item/', body, content_type='application/json')
+            for index in range(total)
+        ], 201),
+        # Rename the site and replace one of its urls
+        'patch': measure_requests([
+            lambda pk=random_id(), index=index: client.patch(f'/item/{pk}', {
+                'name': f'Patched site {index}',
+                'url': [{'description': f'site{pk}.com'}, {'description': f'patched{index}.com'}],
+            }, content_type='application/json')
+            for index in range(total)
+        ], 200),
+    }
+
+# Run the suite on a catalog of each number of sites and return the results.
+# The reads skip the cache of the sites unless cache is true, so they
+# measure the queries and the representation
+def run_suite(catalogs=(10000,), requests=200, seed=0, chunk_size=1000, cache=False):
+    runs = []
+    overrides = {'ALLOWED_HOSTS': ['testserver']}
+    if not cache:
+        overrides['SITES_CACHE'] = {'BACKEND': None}
+    with tempfile.TemporaryDirectory() as directory, override_settings(**overrides):
+        for sites in catalogs:
+            path = os.path.join(directory, f'sites-{sites}.csv')
+            write_catalog(path, sites, seed)
+            try:
+                run = {'sites': sites, 'import': benchmark_import(path, sites, chunk_size)}
+                run['endpoints'] = benchmark_endpoints(requests, random.Random(seed))
+                run['peak_rss_mb'] = peak_rss_mb()
+            finally:
+                truncate_sites()
+            runs.append(run)
+    return {
+        'version': RESULTS_VERSION,
+        'database': connection.vendor,
+        'python': platform.python_version(),
+        'requests': requests,
+        'seed': seed,
+        'cache': cache,
+        'runs': runs,
+    }
+
+# Return the regressions of the results against the baseline, as messages.
+# The times and the memory regress when they're worse by more than the
+# threshold (0.2 is 20%), the queries on any increase. Only the catalogs
+# and endpoints in both are compared
+def compare_results(results, baseline, threshold=0.2):
+    regressions = []
+
+    def check(label, key, value, base, regressed):
+        if regressed:
+            regressions.append(f'{label} {key}: {base} -> {value}')
+
+    baseline_runs = {run['sites']: run for run in baseline['runs']}
+    for run in results['runs']:
+        base = baseline_runs.get(run['sites'])
+        if base is None:
+            continue
+        label = f'{run["sites"]} sites'
+        value, base_value = run['peak_rss_mb'], base['peak_rss_mb']
+        check(label, 'peak_rss_mb', value, base_value, value > base_value * (1 + threshold))
+
+        imported, base_imported = run['import'], base['import']
+        value, base_value = imported['rows_per_second'], base_imported['rows_per_second']
+        check(f'{label} import', 'rows_per_second', value, base_value,
+              value < base_value / (1 + threshold))
+        value, base_value = imported['queries_per_1000_rows'], base_imported['queries_per_1000_rows']
+        check(f'{label} import', 'queries_per_1000_rows', value, base_value, value > base_value)
+
+        for name, endpoint in run['endpoints'].items():
+            base_endpoint = base['endpoints'].get(name)
+            if base_endpoint is None:
+                continue
+            for key in ('p50_ms', 'p99_ms'):
+                value, base_value = endpoint[key], base_endpoint[key]
+                check(f'{label} {name}', key, value, base_value, value > base_value * (1 + threshold))
+            value, base_value = endpoint['queries_per_request'], base_endpoint['queries_per_request']
+            check(f'{label} {name}', 'queries_per_request', value, base_value, value > base_value)
+    return regressions
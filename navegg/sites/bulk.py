@@ -0,0 +1,254 @@
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from rest_framework import serializers, status
+from sites.loader import LOOKUP_BATCH_SIZE, lookup_ids
+from sites.models import Sites, SiteCategory, SiteChange, SiteURL, violates_unique_name
+from sites.representation import represent_queryset
+from sites.serializers import SitesSerializer
+from sites.signals import sites_changed
+
+CREATE = 'create'
+PATCH = 'patch'
+DELETE = 'delete'
+
+# Apply a list of create, patch and delete operations on sites in a single
+# transaction. All the operations are validated first and nothing is written
+# if one of them is invalid. The writes are done with set based queries, so
+# the number of queries doesn't depend on the number of operations
+#
+# [
+#     {"op": "create", "data": {"name": ..., "url": [...], "category": [...]}},
+#     {"op": "patch", "id": 1, "data": {...}},
+#     {"op": "delete", "id": 2}
+# ]
+class SitesBulkOperations:
+
+    def __init__(self, data):
+        self.initial_data = data
+        self.operations = []
+        self.results = []
+        self.errors = None
+
+    def error(self, index, error_status, errors):
+        self.results[index] = {
+            'op': self.results[index]['op'], 'status': error_status, 'errors': errors
+        }
+
+    def is_valid(self):
+        if not isinstance(self.initial_data, list):
+            self.errors = {'non_field_errors': ['Expected a list of operations']}
+            return False
+
+        max_operations = getattr(settings, 'SITES_BULK_MAX_OPERATIONS', 1000)
+        if len(self.initial_data) > max_operations:
+            self.errors = {
+                'non_field_errors': [f'At most {max_operations} operations are allowed']
+            }
+            return False
+
+        self.results = [{'op': None, 'status': None} for _ in self.initial_data]
+        self.operations = [None] * len(self.initial_data)
+
+        # Check the format of the operations and load the sites they change
+        # in a single query
+        site_ids = {}
+        for index, operation in enumerate(self.initial_data):
+            if not isinstance(operation, dict) or operation.get('op') not in (CREATE, PATCH, DELETE):
+                self.error(index, status.HTTP_400_BAD_REQUEST, {'op': 'Unknown operation'})
+                continue
+            self.results[index]['op'] = operation['op']
+            if operation['op'] == CREATE:
+                continue
+            # JSON true and false are bools, which are ints in Python
+            site_id = operation.get('id')
+            if not isinstance(site_id, int) or isinstance(site_id, bool):
+                self.error(index, status.HTTP_400_BAD_REQUEST, {'id': 'A valid integer is required'})
+            elif site_id in site_ids:
+                self.error(index, status.HTTP_400_BAD_REQUEST,
+                           {'id': 'This site is already changed by another operation'})
+            else:
+                site_ids[site_id] = index
+        sites = Sites.objects.in_bulk(list(site_ids))
+
+        # A single serializer validates all the created sites and another one
+        # the patched ones, where every field is optional, so their fields
+        # are built only once
+        validators = {CREATE: SitesSerializer(), PATCH: SitesSerializer(partial=True)}
+        names = {}
+        for index, operation in enumerate(self.initial_data):
+            if self.results[index]['status'] is not None:
+                continue
+
+            site = None
+            if operation['op'] != CREATE:
+                site = sites.get(operation['id'])
+                if site is None:
+                    self.error(index, status.HTTP_404_NOT_FOUND, {'detail': 'Not found.'})
+                    continue
+            if operation['op'] == DELETE:
+                self.operations[index] = (DELETE, site, None)
+                continue
+
+            if not isinstance(operation.get('data'), dict):
+                self.error(index, status.HTTP_400_BAD_REQUEST, {'data': 'Expected a site'})
+                continue
+            serializer = validators[operation['op']]
+            try:
+                validated_data = serializer.run_validation(operation['data'])
+                serializer.validate_references(validated_data)
+            except serializers.ValidationError as error:
+                self.error(index, status.HTTP_400_BAD_REQUEST, error.detail)
+                continue
+
+            name = validated_data.get('name')
+            if name is not None:
+                if name in names:
+                    self.error(index, status.HTTP_400_BAD_REQUEST,
+                               {'name': 'This name is used by another operation'})
+                    continue
+                names[name] = index
+            self.operations[index] = (operation['op'], site, validated_data)
+
+        # Check the names of all the created and patched sites at once
+        for name, site_id in lookup_ids(Sites, 'name', names).items():
+            index = names[name]
+            if self.operations[index] is None:
+                continue
+            site = self.operations[index][1]
+            if site is None or site.id != site_id:
+                self.error(index, status.HTTP_400_BAD_REQUEST, {'name': 'This name already exists'})
+                self.operations[index] = None
+
+        if any(operation is None for operation in self.operations):
+            # The valid operations are not applied because others failed
+            for result in self.results:
+                if result['status'] is None:
+                    result['status'] = status.HTTP_424_FAILED_DEPENDENCY
+            self.errors = self.results
+            return False
+        return True
+
+    def save(self):
+        created = []
+        patched = []
+        changes = []
+        deleted = []
+        sites = []
+        for operation, site, validated_data in self.operations:
+            if operation == DELETE:
+                deleted.append(site.id)
+            else:
+                if operation == CREATE:
+                    site = Sites()
+                    created.append(site)
+                # Only the fields passed and different are written
+                changed = False
+                for field in ('name', 'active'):
+                    if field in validated_data and getattr(site, field) != validated_data[field]:
+                        setattr(site, field, validated_data[field])
+                        changed = True
+                if changed and operation == PATCH:
+                    patched.append(site)
+                changes.append((site, validated_data))
+            sites.append(site)
+
+        try:
+            with transaction.atomic():
+                if getattr(settings, 'SITES_SOFT_DELETE', True):
+                    Sites.objects.filter(id__in=deleted).soft_delete()
+                    if deleted:
+                        sites_changed.send(sender=Sites, site_ids=deleted, action=SiteChange.DELETED)
+                else:
+                    Sites.objects.filter(id__in=deleted).delete()
+                Sites.objects.bulk_update(patched, ['name', 'active'])
+                Sites.objects.bulk_create(created)
+
+                # Some backends don't return the ids of the created sites
+                if not connection.features.can_return_rows_from_bulk_insert:
+                    site_ids = lookup_ids(Sites, 'name', [site.name for site in created])
+                    for site in created:
+                        site.id = site_ids[site.name]
+
+                # The patched sites whose fields or links changed, the ones
+                # without changes keep their version and aren't sent
+                updated = {site.id for site in patched}
+                updated |= self.set_references(changes, 'url', SiteURL)
+                updated |= self.set_references(changes, 'category', SiteCategory)
+                updated -= {site.id for site in created}
+                Sites.objects.filter(id__in=updated).touch()
+
+                # The bulk queries don't send the model signals, the deleted
+                # sites are sent by the delete or above. Nothing is sent when
+                # no site changed, which would start a new generation of the
+                # cached pages
+                if created:
+                    sites_changed.send(
+                        sender=Sites, site_ids=[site.id for site in created], action=SiteChange.CREATED
+                    )
+                if updated:
+                    sites_changed.send(
+                        sender=Sites, site_ids=sorted(updated), action=SiteChange.UPDATED
+                    )
+        except IntegrityError as error:
+            if not violates_unique_name(error):
+                raise
+            # Another request used one of the names in the meantime
+            raise serializers.ValidationError({'name': 'This name already exists'})
+
+        # Serialize all the changed sites at once, with a single query per relation
+        changed = {
+            site['id']: site
+            for site in represent_queryset(Sites.objects.filter(id__in=[site.id for site, _ in changes]))
+        }
+        data = iter([changed[site.id] for site, _ in changes])
+        for index, (operation, _, _) in enumerate(self.operations):
+            result = self.results[index]
+            if operation == DELETE:
+                result['id'] = sites[index].id
+                result['status'] = status.HTTP_204_NO_CONTENT
+            else:
+                result['status'] = (
+                    status.HTTP_201_CREATED if operation == CREATE else status.HTTP_200_OK
+                )
+                result['data'] = next(data)
+
+    # Change the url or category links of the sites passing it in the request
+    # to the ones in the request. The current links of all the sites are read
+    # at once and only the ones that changed are removed and added. Return
+    # the ids of the sites whose links changed
+    def set_references(self, changes, field_name, reference_model):
+        changes = [(site, data[field_name]) for site, data in changes if field_name in data]
+        if not changes:
+            return set()
+
+        references = reference_model.objects.resolve(
+            item['description'] for _, items in changes for item in items
+        )
+        references = {reference.description: reference.id for reference in references}
+
+        through = getattr(Sites, field_name).through
+        reference_column = f'{reference_model._meta.model_name}_id'
+        current = {
+            (site_id, reference_id): link_id
+            for link_id, site_id, reference_id in through.objects.filter(
+                sites_id__in=[site.id for site, _ in changes]
+            ).values_list('id', 'sites_id', reference_column)
+        }
+        requested = dict.fromkeys(
+            (site.id, references[item['description']]) for site, items in changes for item in items
+        )
+        removed = [link for link in current if link not in requested]
+        added = [link for link in requested if link not in current]
+
+        removed_ids = [current[link] for link in removed]
+        for start in range(0, len(removed_ids), LOOKUP_BATCH_SIZE):
+            through.objects.filter(id__in=removed_ids[start:start + LOOKUP_BATCH_SIZE]).delete()
+        through.objects.bulk_create([
+            through(**{'sites_id': site_id, reference_column: reference_id})
+            for site_id, reference_id in added
+        ])
+        return {site_id for site_id, _ in removed + added}
+
+    @property
+    def data(self):
+        return self.results
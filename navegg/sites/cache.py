@@ -0,0 +1,230 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from sites.changes import LogFollower
+
+# Cache of the serialized sites returned by the read endpoints. The payload of
+# a site is stored by its id and the pages of the list by their query string.
+# Any change to a site removes its payload and starts a new generation of the
+# list pages, the pages of older generations are never read again
+#
+# The changes are removed right away from the cache of the process making
+# them. The cache in the memory of the other processes reads the change log
+# every refresh_interval seconds, like the index, and removes the sites
+# changed since its last read
+
+MISS = object()
+
+# Least recently used cache in the memory of the process
+class LRUCache:
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key, MISS)
+            if value is not MISS:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def size(self):
+        return len(self.entries)
+
+# Cache stored in one of the Django cache backends of the CACHES setting,
+# shared by all the processes using the same backend. The alias can be
+# shared with other uses: the keys start with key_prefix and carry the
+# generation stored in the backend as their version, and clearing starts a
+# new generation, leaving the old keys to expire after timeout seconds
+class DjangoCache:
+
+    def __init__(self, alias='default', timeout=300, key_prefix='sites'):
+        self.cache = caches[alias]
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+
+    def key(self, key):
+        return f'{self.key_prefix}:{key}'
+
+    # The generation is read on every call, so a clear of any process is
+    # seen by the next one. When it's missing a new one is started from the
+    # clock, like the generation of the list pages
+    def generation(self):
+        key = self.key('generation')
+        generation = self.cache.get(key)
+        if generation is None:
+            self.cache.add(key, time.time_ns(), None)
+            generation = self.cache.get(key)
+        return generation
+
+    def get(self, key):
+        return self.cache.get(self.key(key), MISS, version=self.generation())
+
+    def set(self, key, value):
+        self.cache.set(self.key(key), value, self.timeout, version=self.generation())
+
+    def delete_many(self, keys):
+        self.cache.delete_many([self.key(key) for key in keys], version=self.generation())
+
+    def clear(self):
+        self.cache.set(self.key('generation'), time.time_ns(), None)
+
+    # The Django backends don't count the keys with a prefix
+    def size(self):
+        return None
+
+class SitesCache:
+
+    def __init__(self, backend, refresh_interval=None, max_log_changes=10000):
+        self.backend = backend
+        # The backend doesn't do any I/O
+        self.in_memory = isinstance(backend, LRUCache)
+        # Seconds between the reads of the change log, None to read only the
+        # changes of this process. More changes than max_log_changes in the
+        # log clear the whole cache
+        self.refresh_interval = refresh_interval
+        self.max_log_changes = max_log_changes
+        self.check_lock = threading.Lock()
+        self.log = LogFollower()
+        self.checked_at = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    # Whether the next read checks the change log, which queries the database
+    def check_due(self):
+        return self.refresh_interval is not None and (
+            self.log.watermark is None
+            or time.monotonic() - self.checked_at >= self.refresh_interval
+        )
+
+    # Remove the sites changed by other processes since the last check. On
+    # the first check the changes made before are unknown and the whole
+    # cache is cleared. A check already running in another thread is enough
+    def check_log(self):
+        if not self.check_lock.acquire(blocking=False):
+            return
+        try:
+            self.checked_at = time.monotonic()
+            if self.log.watermark is None:
+                self.log.start(self.max_log_changes)
+                self.invalidate()
+                return
+            changes = self.log.read(self.max_log_changes + 1)
+            if len(changes) > self.max_log_changes:
+                self.log.start(self.max_log_changes)
+                self.invalidate()
+            elif changes:
+                self.invalidate({site_id for _, site_id, _ in changes})
+        finally:
+            self.check_lock.release()
+
+    def get(self, key):
+        if self.check_due():
+            self.check_log()
+        value = self.backend.get(key)
+        if value is MISS:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    # The generation of the list pages is stored in the backend so all the
+    # processes sharing it see the new generation. When it's missing a new
+    # one is started from the clock, so it can't match an older generation
+    def list_generation(self):
+        generation = self.backend.get('list:generation')
+        if generation is MISS:
+            generation = time.time_ns()
+            self.backend.set('list:generation', generation)
+        return generation
+
+    def site_key(self, site_id):
+        return f'site:{site_id}'
+
+    def list_key(self, params, generation):
+        query = '&'.join(f'{key}={value}' for key, value in sorted(params.items()))
+        return f'list:{generation}:{query}'
+
+    def get_site(self, site_id):
+        return self.get(self.site_key(site_id))
+
+    def set_site(self, site_id, data):
+        self.backend.set(self.site_key(site_id), data)
+
+    # The generation is read before querying the database and passed back
+    # to set_list, so a page built while a site changed is stored in the old
+    # generation and never returned
+    def get_list(self, params):
+        generation = self.list_generation()
+        return generation, self.get(self.list_key(params, generation))
+
+    def set_list(self, params, generation, value):
+        self.backend.set(self.list_key(params, generation), value)
+
+    # Remove the sites with the ids, or all the sites when site_ids is None
+    def invalidate(self, site_ids=None):
+        self.invalidations += 1
+        if site_ids is None:
+            self.backend.clear()
+        else:
+            self.backend.delete_many([self.site_key(site_id) for site_id in site_ids])
+        self.backend.set('list:generation', time.time_ns())
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            # None when the backend can't count them
+            'entries': self.backend.size(),
+        }
+
+# Cache configured by the SITES_CACHE setting, None when caching is disabled
+_cache = MISS
+
+def get_cache():
+    global _cache
+    if _cache is MISS:
+        config = getattr(settings, 'SITES_CACHE', {})
+        backend = config.get('BACKEND', 'lru')
+        if backend == 'lru':
+            _cache = SitesCache(
+                LRUCache(config.get('MAX_ENTRIES', 10000)), config.get('REFRESH_INTERVAL', 1)
+            )
+        elif backend == 'django':
+            _cache = SitesCache(DjangoCache(config.get('ALIAS', 'default'), config.get('TIMEOUT', 300)))
+        else:
+            _cache = None
+    return _cache
+
+@receiver(setting_changed)
+def reset_cache(setting, **kwargs):
+    global _cache
+    if setting == 'SITES_CACHE':
+        _cache = MISS
@@ -0,0 +1,110 @@
+import base64
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Max, Min
+from django.utils import timezone
+from sites.models import SiteChange
+
+# Woken when changes are committed by this process, so the long polls of the
+# change feed answer right away instead of at the next poll
+_condition = threading.Condition()
+
+def notify():
+    with _condition:
+        _condition.notify_all()
+
+# The token is opaque to the clients, it's the id of the last change they read
+def encode_token(change_id):
+    return base64.urlsafe_b64encode(f'c{change_id}'.encode()).decode().rstrip('=')
+
+# Return the id of the change in the token, or None when it's invalid
+def decode_token(token):
+    try:
+        value = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not value.startswith('c') or not value[1:].isdigit():
+        return None
+    return int(value[1:])
+
+# The changes are read after a watermark, the id of a change such that every
+# change before it was read or won't ever be committed. The ids are taken
+# when the changes are inserted, not when they're committed, so on
+# PostgreSQL a change can be committed after the changes with higher ids
+# were read. A missing id is a change not committed yet or rolled back, and
+# the watermark stops before it until a change after it is older than
+# SITES_CHANGES_SAFETY_LAG seconds, the longest a transaction writing the
+# sites is expected to stay open
+def settled_before():
+    return timezone.now() - timedelta(seconds=getattr(settings, 'SITES_CHANGES_SAFETY_LAG', 10))
+
+# Return up to limit changes after the watermark as (id, site_id, action)
+# rows, and the watermark after them. The changes after the new watermark
+# are read again from it
+def read_log(since, limit):
+    rows = list(
+        SiteChange.objects.filter(id__gt=since)
+        .order_by('id')
+        .values_list('id', 'site_id', 'action', 'created_at')[:limit]
+    )
+    settled = settled_before()
+    # The ids missing before a settled change are settled too
+    watermark = max([since] + [row[0] for row in rows if row[3] <= settled])
+    for row in rows:
+        if row[0] > watermark + 1:
+            break
+        watermark = max(watermark, row[0])
+    return [row[:3] for row in rows], watermark
+
+# Return the watermark of the whole log, the last settled change, to read
+# the changes made from now on
+def log_head():
+    return SiteChange.objects.filter(created_at__lte=settled_before()).aggregate(
+        last=Max('id')
+    )['last'] or 0
+
+# Follows the log for the caches of the process. Each read returns the
+# changes not returned yet, the ones after the watermark being read again
+# until it passes them
+class LogFollower:
+    def __init__(self):
+        self.watermark = None
+        self.pending = set()
+
+    # Follow the log from its head, and return up to limit changes made
+    # after it, already known to the caller reading everything again
+    def start(self, limit):
+        self.watermark = log_head()
+        self.pending = set()
+        return self.read(limit)
+
+    # Return up to limit changes not returned yet
+    def read(self, limit):
+        rows, watermark = read_log(self.watermark, limit)
+        changes = [row for row in rows if row[0] not in self.pending]
+        self.watermark = watermark
+        self.pending = {row[0] for row in rows if row[0] > watermark}
+        return changes
+
+# Return whether changes after the watermark were removed from the log, the
+# first one kept being after the next id
+def log_expired(since):
+    first = SiteChange.objects.aggregate(first=Min('id'))['first']
+    return first is not None and first > since + 1
+
+# Return the changes up to the watermark after since, at most limit of them,
+# and the watermark, waiting up to wait seconds for the first one. Changes
+# committed by other processes are found by polling the log every
+# poll_interval seconds
+def wait_for_changes(since, limit, wait, poll_interval=1.0):
+    deadline = time.monotonic() + wait
+    while True:
+        rows, watermark = read_log(since, limit)
+        rows = [row for row in rows if row[0] <= watermark]
+        remaining = deadline - time.monotonic()
+        if rows or remaining <= 0:
+            return rows, watermark
+        with _condition:
+            _condition.wait(min(poll_interval, remaining))
@@ -0,0 +1,62 @@
+from sites.normalize import url_segments
+
+# Key of the node holding the urls ending at it, no segment is None
+END = None
+
+# Trie of the urls of the sites by their segments (see url_segments), to find
+# the longest urls a visited url is under: "car.com/news" for
+# "https://car.com/news/123?x=1" when both "car.com" and "car.com/news" exist,
+# and "car.com" for "https://blog.car.com/". Urls with the same segments, like
+# "car.com" and "www.car.com", end at the same node
+class URLTrie:
+
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+
+    def insert(self, url):
+        node = self.root
+        for segment in url_segments(url):
+            node = node.setdefault(segment, {})
+        urls = node.setdefault(END, set())
+        if url not in urls:
+            urls.add(url)
+            self.size += 1
+
+    def remove(self, url):
+        segments = url_segments(url)
+        path = [self.root]
+        for segment in segments:
+            node = path[-1].get(segment)
+            if node is None:
+                return
+            path.append(node)
+        urls = path[-1].get(END)
+        if urls is None or url not in urls:
+            return
+        urls.remove(url)
+        self.size -= 1
+        if not urls:
+            del path[-1][END]
+        # Drop the nodes left empty
+        for depth in range(len(segments), 0, -1):
+            if path[depth]:
+                break
+            del path[depth - 1][segments[depth - 1]]
+
+    # Return the set of the longest urls the segments are under, or None
+    def match_segments(self, segments):
+        node = self.root
+        match = None
+        for segment in segments:
+            node = node.get(segment)
+            if node is None:
+                break
+            match = node.get(END, match)
+        return match
+
+    def match(self, url):
+        return self.match_segments(url_segments(url))
+
+    def __len__(self):
+        return self.size
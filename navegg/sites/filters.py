@@ -0,0 +1,63 @@
+from django.db import connections
+from rest_framework import serializers
+from sites.models import SiteCategoryLink, SiteURLLink
+from sites.normalize import url_host
+
+TRUE_VALUES = ('1', 'true')
+FALSE_VALUES = ('0', 'false')
+
+# Read a boolean from the query parameters, None when it's missing
+def get_bool_param(request, name):
+    value = request.query_params.get(name)
+    if value is None or value == '':
+        return None
+    if value.lower() in TRUE_VALUES:
+        return True
+    if value.lower() in FALSE_VALUES:
+        return False
+    raise serializers.ValidationError({name: 'Must be a valid boolean'})
+
+# Filter the sites by the query parameters of the list. Every filter is
+# answered by an index, the categories and hosts through the index of the
+# links from the category or url to the sites, so the pages are still read
+# in id order without scanning the sites
+#
+#   ?active=true               sites active or not, only the active ones by
+#                              default and every site with ?active=all
+#   ?category=news             sites with the category
+#   ?url_host=car.com          sites with a url on the host
+#   ?name__startswith=Site     sites with the name starting with the prefix,
+#                              case sensitive
+def filter_sites(queryset, request):
+    if request.query_params.get('active') != 'all':
+        active = get_bool_param(request, 'active')
+        queryset = queryset.filter(active=True if active is None else active)
+
+    category = request.query_params.get('category')
+    if category:
+        queryset = queryset.filter(id__in=SiteCategoryLink.objects.filter(
+            sitecategory__description=category
+        ).values('sites_id'))
+
+    host = request.query_params.get('url_host')
+    if host:
+        queryset = queryset.filter(id__in=SiteURLLink.objects.filter(
+            siteurl__host=url_host(host)
+        ).values('sites_id'))
+
+    prefix = request.query_params.get('name__startswith')
+    if prefix:
+        queryset = filter_prefix(queryset, prefix)
+
+    return queryset
+
+# Filter the sites with the name starting with the prefix. In SQLite it's a
+# range on the name instead of a LIKE, which it can't answer from the index
+# and which ignores the case. The range only has the names with the prefix
+# in the order of the code points, SQLite's BINARY collation, so the other
+# databases, whose collations can order the names by language, use the LIKE
+def filter_prefix(queryset, prefix):
+    last = ord(prefix[-1])
+    if connections[queryset.db].vendor != 'sqlite' or last == 0x10FFFF:
+        return queryset.filter(name__startswith=prefix)
+    return queryset.filter(name__gte=prefix, name__lt=prefix[:-1] + chr(last + 1))
@@ -0,0 +1,254 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from sites.changes import LogFollower
+from sites.models import SiteCategoryLink, SiteURLLink
+from sites.classify import URLTrie
+from sites.normalize import normalize_url, url_host
+
+CATEGORY = 0
+URL = 1
+HOST = 2
+
+# Inverted index of the active sites in the memory of the process, answering
+# which sites have a category, a url or a url on a host without querying the
+# database. The sites of each key are kept in a sorted array of ids, and the
+# urls in a trie to classify visited urls
+#
+# The index is built on the first lookup. The sites changed by this process
+# are marked as stale by the sites_changed signal and read again on the next
+# lookup, and every refresh_interval seconds the change log is read to find
+# the sites changed by other processes
+class SitesIndex:
+
+    def __init__(self, refresh_interval=5, max_log_changes=10000):
+        self.refresh_interval = refresh_interval
+        # More changes than this in the log rebuild the whole index
+        self.max_log_changes = max_log_changes
+        self.lock = threading.RLock()
+        self.built = False
+        self.keys = ({}, {}, {})
+        self.trie = URLTrie()
+        # The keys of each site, to remove it from the arrays
+        self.site_keys = {}
+        self.stale = set()
+        self.stale_all = False
+        self.log = LogFollower()
+        self.checked_at = 0
+        self.built_at = None
+        self.refreshes = 0
+
+    # Load the whole index from the database
+    def build(self):
+        # Read the log first, the changes made while the index is built are
+        # read again on the next check
+        self.log.start(self.max_log_changes)
+        self.checked_at = time.monotonic()
+        self.keys = ({}, {}, {})
+        self.trie = URLTrie()
+        self.site_keys = {}
+        self.stale = set()
+        self.stale_all = False
+        self.load(None)
+        self.built = True
+        self.built_at = time.time()
+
+    # Add the links of the active sites with the ids, or of every active site
+    # when site_ids is None
+    def load(self, site_ids):
+        categories = SiteCategoryLink.objects.active()
+        urls = SiteURLLink.objects.active()
+        if site_ids is not None:
+            categories = categories.filter(sites_id__in=site_ids)
+            urls = urls.filter(sites_id__in=site_ids)
+
+        # A few sites are inserted in place, the whole index is appended and
+        # sorted at the end
+        add = self.insert if site_ids is not None else self.append
+        for description, site_id in categories.values_list('sitecategory__description', 'sites_id'):
+            add(CATEGORY, description, site_id)
+        for description, host, site_id in urls.values_list(
+            'siteurl__description', 'siteurl__host', 'sites_id'
+        ):
+            add(URL, description, site_id)
+            add(HOST, host, site_id)
+
+        if site_ids is None:
+            for keys in self.keys:
+                for key, ids in keys.items():
+                    keys[key] = array('i', sorted(ids))
+
+    def site_key(self, kind, key, site_id):
+        site_keys = self.site_keys.setdefault(site_id, (set(), set(), set()))[kind]
+        if key in site_keys:
+            return False
+        site_keys.add(key)
+        return True
+
+    # Return the array of the key, adding the key when it's new
+    def ids(self, kind, key):
+        ids = self.keys[kind].get(key)
+        if ids is None:
+            ids = self.keys[kind][key] = array('i')
+            if kind == URL:
+                self.trie.insert(key)
+        return ids
+
+    def append(self, kind, key, site_id):
+        if self.site_key(kind, key, site_id):
+            self.ids(kind, key).append(site_id)
+
+    def insert(self, kind, key, site_id):
+        if self.site_key(kind, key, site_id):
+            insort(self.ids(kind, key), site_id)
+
+    # Remove the site from the arrays of all its keys
+    def remove(self, site_id):
+        for kind, site_keys in enumerate(self.site_keys.pop(site_id, ())):
+            keys = self.keys[kind]
+            for key in site_keys:
+                ids = keys[key]
+                position = bisect_left(ids, site_id)
+                if position < len(ids) and ids[position] == site_id:
+                    del ids[position]
+                if not ids:
+                    del keys[key]
+                    if kind == URL:
+                        self.trie.remove(key)
+
+    # Drop the index, it's built again on the next lookup
+    def clear(self):
+        with self.lock:
+            self.built = False
+            self.keys = ({}, {}, {})
+            self.trie = URLTrie()
+            self.site_keys = {}
+            self.stale = set()
+
+    # Mark the sites with the ids, or every site when site_ids is None, to be
+    # read again on the next lookup
+    def mark_stale(self, site_ids):
+        with self.lock:
+            if not self.built:
+                return
+            if site_ids is None:
+                self.stale_all = True
+            else:
+                self.stale.update(site_ids)
+
+    # Mark the sites changed by other processes since the last check
+    def check_log(self):
+        self.checked_at = time.monotonic()
+        changes = self.log.read(self.max_log_changes + 1)
+        if len(changes) > self.max_log_changes:
+            self.stale_all = True
+        elif changes:
+            self.stale.update(site_id for _, site_id, _ in changes)
+
+    # Bring the index up to date before a lookup
+    def refresh(self):
+        if not self.built:
+            self.build()
+            return
+        if (self.refresh_interval is not None
+                and time.monotonic() - self.checked_at >= self.refresh_interval):
+            self.check_log()
+        if self.stale_all:
+            self.build()
+            self.refreshes += 1
+        elif self.stale:
+            site_ids, self.stale = self.stale, set()
+            for site_id in site_ids:
+                self.remove(site_id)
+            self.load(site_ids)
+            self.refreshes += 1
+
+    # Return the number of active sites with the key and the ids of up to
+    # limit of them after the cursor, in id order
+    def lookup(self, kind, key, cursor=0, limit=None):
+        with self.lock:
+            self.refresh()
+            ids = self.keys[kind].get(key, ())
+            start = bisect_right(ids, cursor)
+            end = len(ids) if limit is None else start + limit
+            return len(ids), list(ids[start:end])
+
+    def category(self, description, cursor=0, limit=None):
+        return self.lookup(CATEGORY, description, cursor, limit)
+
+    def url(self, description, cursor=0, limit=None):
+        return self.lookup(URL, description, cursor, limit)
+
+    def host(self, host, cursor=0, limit=None):
+        return self.lookup(HOST, url_host(host), cursor, limit)
+
+    # Return the classification of each url: the longest url of the sites it
+    # is under, normalized, with the ids of its active sites and their
+    # categories. The url is None when it isn't under any url of the sites
+    def classify(self, urls):
+        with self.lock:
+            self.refresh()
+            # Repeated urls and urls under the same url are answered once
+            by_url = {}
+            by_match = {}
+            results = []
+            for url in urls:
+                result = by_url.get(url)
+                if result is None:
+                    match = self.trie.match(url)
+                    result = by_match.get(id(match)) if match is not None else None
+                    if result is None:
+                        result = self.match_result(match)
+                        if match is not None:
+                            by_match[id(match)] = result
+                    by_url[url] = result
+                results.append(result)
+            return results
+
+    def match_result(self, match):
+        if match is None:
+            return {'match': None, 'sites': [], 'categories': []}
+        site_ids = set()
+        for url in match:
+            site_ids.update(self.keys[URL][url])
+        categories = set()
+        for site_id in site_ids:
+            categories.update(self.site_keys[site_id][CATEGORY])
+        return {
+            'match': normalize_url(next(iter(match))),
+            'sites': sorted(site_ids),
+            'categories': sorted(categories),
+        }
+
+    def stats(self):
+        with self.lock:
+            return {
+                'built': self.built,
+                'built_at': self.built_at,
+                'sites': len(self.site_keys),
+                'categories': len(self.keys[CATEGORY]),
+                'urls': len(self.keys[URL]),
+                'hosts': len(self.keys[HOST]),
+                'trie': len(self.trie),
+                'stale': len(self.stale),
+                'refreshes': self.refreshes,
+            }
+
+# Index of the process, built on its first lookup
+_index = None
+
+def get_index():
+    global _index
+    if _index is None:
+        _index = SitesIndex(getattr(settings, 'SITES_INDEX_REFRESH_INTERVAL', 5))
+    return _index
+
+@receiver(setting_changed)
+def reset_index(setting, **kwargs):
+    global _index
+    if setting == 'SITES_INDEX_REFRESH_INTERVAL':
+        _index = None
@@ -0,0 +1,193 @@
+import json
+import multiprocessing
+import os
+import time
+from itertools import chain
+from django.db import connection, transaction
+from sites.models import Sites, SiteCategory, SiteChange, SiteURL
+from sites.parsing import collect_vocabulary, parse_range, shard_ranges
+from sites.signals import sites_changed
+
+# Maximum number of values passed to one IN lookup, below the SQLite limit
+# of variables in a query
+LOOKUP_BATCH_SIZE = 900
+
+# Run the IN lookup in batches and return the (field, id) pairs found
+def lookup_ids(model, field, values):
+    values = list(values)
+    found = {}
+    for start in range(0, len(values), LOOKUP_BATCH_SIZE):
+        batch = values[start:start + LOOKUP_BATCH_SIZE]
+        lookup = {f'{field}__in': batch}
+        found.update(model.objects.filter(**lookup).values_list(field, 'id'))
+    return found
+
+# Load sites in chunks using set based queries and bulk inserts, each chunk
+# is committed in its own transaction and recorded in the checkpoint file so
+# an interrupted load can be resumed
+class BulkLoader:
+
+    def __init__(self, chunk_size=1000, checkpoint=None, log=print):
+        self.chunk_size = chunk_size
+        self.checkpoint = checkpoint
+        self.log = log
+        self.rows = 0
+        self.created = 0
+        self.skipped = 0
+        # Ids of the descriptions already resolved, by model
+        self.vocabulary = {SiteURL: {}, SiteCategory: {}}
+
+    # Return the number of rows already loaded by a previous run
+    def read_checkpoint(self):
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return 0
+        with open(self.checkpoint) as checkpoint_file:
+            return json.load(checkpoint_file)['rows']
+
+    # Write the checkpoint atomically so a crash never leaves it half written
+    def write_checkpoint(self):
+        if self.checkpoint is None:
+            return
+        temp_path = f'{self.checkpoint}.tmp'
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump({'rows': self.rows}, checkpoint_file)
+        os.replace(temp_path, self.checkpoint)
+
+    def remove_checkpoint(self):
+        if self.checkpoint is not None and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+    # Load all the records, each record is (name, active, urls, categories)
+    def load(self, records):
+        self.rows = self.read_checkpoint()
+        if self.rows > 0:
+            self.log(f'Resuming after {self.rows} rows')
+
+        records = iter(records)
+        # Skip the rows loaded before the checkpoint
+        for _ in range(self.rows):
+            if next(records, None) is None:
+                break
+
+        start = time.monotonic()
+        loaded = 0
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) == self.chunk_size:
+                loaded += self.load_chunk(chunk)
+                self.report(loaded, start)
+                chunk = []
+        if chunk:
+            loaded += self.load_chunk(chunk)
+            self.report(loaded, start)
+
+        self.remove_checkpoint()
+        return loaded
+
+    def report(self, loaded, start):
+        elapsed = max(time.monotonic() - start, 1e-9)
+        self.log(f'{self.rows} rows loaded, {self.created} sites created, '
+                 f'{self.skipped} skipped ({loaded / elapsed:.0f} rows/sec)')
+
+    # Insert one chunk of records in a single transaction
+    def load_chunk(self, chunk):
+        with transaction.atomic():
+            # The first row with a name wins, repeated names and names that
+            # already exist in the database are skipped
+            records = {}
+            for record in chunk:
+                if record[0] not in records:
+                    records[record[0]] = record
+            existing = lookup_ids(Sites, 'name', records.keys())
+            records = [record for name, record in records.items() if name not in existing]
+
+            urls = self.resolve(
+                SiteURL, dict.fromkeys(url for record in records for url in record[2])
+            )
+            categories = self.resolve(
+                SiteCategory,
+                dict.fromkeys(category for record in records for category in record[3]),
+            )
+
+            sites = Sites.objects.bulk_create(
+                [Sites(name=record[0], active=record[1]) for record in records],
+                batch_size=LOOKUP_BATCH_SIZE,
+            )
+            # The insert returns the ids where the database supports it
+            if connection.features.can_return_rows_from_bulk_insert:
+                site_ids = {site.name: site.id for site in sites}
+            else:
+                site_ids = lookup_ids(Sites, 'name', [record[0] for record in records])
+
+            url_links = []
+            category_links = []
+            for name, active, record_urls, record_categories in records:
+                for url in record_urls:
+                    url_links.append(Sites.url.through(
+                        sites_id=site_ids[name], siteurl_id=urls[url]
+                    ))
+                for category in record_categories:
+                    category_links.append(Sites.category.through(
+                        sites_id=site_ids[name], sitecategory_id=categories[category]
+                    ))
+            Sites.url.through.objects.bulk_create(url_links, batch_size=LOOKUP_BATCH_SIZE)
+            Sites.category.through.objects.bulk_create(
+                category_links, batch_size=LOOKUP_BATCH_SIZE
+            )
+
+            # The bulk queries don't send the model signals
+            if site_ids:
+                sites_changed.send(
+                    sender=Sites, site_ids=list(site_ids.values()), action=SiteChange.CREATED
+                )
+
+        self.rows += len(chunk)
+        self.created += len(records)
+        self.skipped += len(chunk) - len(records)
+        self.write_checkpoint()
+        return len(chunk)
+
+    # Return the ids of the descriptions, creating the missing ones
+    def resolve(self, model, descriptions):
+        known = self.vocabulary[model]
+        unknown = [description for description in descriptions if description not in known]
+        if unknown:
+            ids = lookup_ids(model, 'description', unknown)
+            missing = [description for description in unknown if description not in ids]
+            if missing:
+                ids.update(
+                    (reference.description, reference.id)
+                    for reference in model.objects.create_missing(
+                        missing, batch_size=LOOKUP_BATCH_SIZE
+                    )
+                )
+            known.update(ids)
+        return known
+
+    # Resolve the whole vocabulary of a file once before loading its rows
+    def preload(self, urls, categories):
+        with transaction.atomic():
+            self.resolve(SiteURL, urls)
+            self.resolve(SiteCategory, categories)
+
+# Load a sites CSV parsing it in a pool of worker processes. The file is split
+# in byte ranges, the workers first collect the distinct URLs and categories,
+# which are created once, and then parse the rows. The parsed rows are merged
+# back in file order and written by this process only, so the result is the
+# same as a sequential load and there are no races on the unique names
+def load_parallel(path, loader, workers, max_shard_size=8 * 1024 * 1024):
+    # At least a few shards per worker to balance the load, but bounded in
+    # size so the parsed rows waiting to be written don't take much memory
+    shard_size = max(min(os.path.getsize(path) // (workers * 4), max_shard_size), 1)
+    shards = shard_ranges(path, shard_size)
+    with multiprocessing.Pool(workers) as pool:
+        urls = {}
+        categories = {}
+        for shard_urls, shard_categories in pool.imap(collect_vocabulary, shards):
+            urls.update(dict.fromkeys(shard_urls))
+            categories.update(dict.fromkeys(shard_categories))
+        loader.preload(list(urls), list(categories))
+
+        records = chain.from_iterable(pool.imap(parse_range, shards))
+        return loader.load(records)
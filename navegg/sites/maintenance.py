@@ -0,0 +1,117 @@
+import time
+from django.db import connections, transaction
+from django.db.models import Exists, Max, OuterRef
+from sites.models import Sites, SiteCategory, SiteCategoryLink, SiteChange, SiteURL, SiteURLLink
+
+# Maintenance jobs run by the management commands, usually from cron at the
+# hours of less traffic. They work in small batches, each one in its own
+# transaction with a pause after it, so they never hold the locks of the
+# tables for long and the requests run between the batches
+
+# Remove for good the sites soft deleted before the time, batch_size sites per
+# transaction, and return the number of sites removed. It stops early when
+# should_stop returns true, like at the end of the window of the job
+def purge_sites(before, batch_size=1000, pause=0, should_stop=None, log=print):
+    purged = 0
+    while should_stop is None or not should_stop():
+        with transaction.atomic():
+            site_ids = list(
+                Sites.all_objects.filter(deleted_at__lt=before)
+                .order_by('deleted_at')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            # The links are removed by the cascade, the sites were already
+            # sent as deleted when they were marked
+            Sites.all_objects.filter(id__in=site_ids).delete()
+
+        purged += len(site_ids)
+        if site_ids:
+            log(f'{purged} sites purged')
+        if len(site_ids) < batch_size:
+            break
+        time.sleep(pause)
+    return purged
+
+# Remove the changes of the log made before the time, batch_size per
+# transaction, and return the number removed. The last one of them is kept
+# as the start of the log: the feed answers the tokens before it with 410,
+# the changes after them are gone
+def prune_changes(before, batch_size=10000, pause=0, should_stop=None, log=print):
+    first_kept = SiteChange.objects.filter(created_at__lt=before).aggregate(last=Max('id'))['last']
+    pruned = 0
+    while first_kept is not None and (should_stop is None or not should_stop()):
+        change_ids = list(
+            SiteChange.objects.filter(id__lt=first_kept)
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        SiteChange.objects.filter(id__in=change_ids).delete()
+
+        pruned += len(change_ids)
+        if change_ids:
+            log(f'{pruned} changes pruned')
+        if len(change_ids) < batch_size:
+            break
+        time.sleep(pause)
+    return pruned
+
+# The links of each kind of reference, the field of the reference in them and
+# the name of the references in the reports
+REFERENCE_LINKS = {
+    SiteURL: (SiteURLLink, 'siteurl', 'urls'),
+    SiteCategory: (SiteCategoryLink, 'sitecategory', 'categories'),
+}
+
+# The urls or categories linked to no site. The NOT EXISTS is an anti-join
+# on the index of the links from the url or category
+def orphan_references(model):
+    link_model, field, _ = REFERENCE_LINKS[model]
+    return model.objects.filter(~Exists(link_model.objects.filter(**{field: OuterRef('pk')})))
+
+# Remove the urls or categories linked to no site, batch_size per transaction,
+# and return the number removed and the bytes of their descriptions. Only the
+# ones with ids up to max_id are removed, by default the last id when the run
+# starts, so the ones created since by the imports and the requests are left
+# until they're linked. The orphans are read in id order outside of the
+# transactions and checked again inside, locked where the database can skip
+# the ones a site is being linked to. With dry_run they're only counted
+def collect_references(model, batch_size=1000, pause=0, should_stop=None, dry_run=False,
+                       max_id=None, log=print):
+    if max_id is None:
+        max_id = model.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+    features = connections[model.objects.db].features
+    removed = 0
+    reclaimed = 0
+    last_id = 0
+    while should_stop is None or not should_stop():
+        rows = list(
+            orphan_references(model).filter(id__gt=last_id, id__lte=max_id).order_by('id')
+            .values_list('id', 'description')[:batch_size]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        if dry_run:
+            deleted = rows
+        else:
+            with transaction.atomic():
+                orphans = orphan_references(model).filter(id__in=[row[0] for row in rows])
+                locked = orphans
+                if features.has_select_for_update_skip_locked:
+                    locked = orphans.select_for_update(skip_locked=True)
+                # The ones still linked to no site, which can't be linked
+                # until the transaction ends
+                deleted = list(locked.values_list('id', 'description'))
+                # One DELETE, without the signals and the collection of the
+                # links of each one: they change no site, and the anti-join
+                # is checked again by the DELETE where nothing was locked
+                orphans.filter(id__in=[row[0] for row in deleted])._raw_delete(model.objects.db)
+        removed += len(deleted)
+        reclaimed += sum(len(description.encode()) for _, description in deleted)
+        log(f'{removed} {REFERENCE_LINKS[model][2]} {"found" if dry_run else "removed"}')
+
+        if len(rows) < batch_size:
+            break
+        time.sleep(pause)
+    return removed, reclaimed
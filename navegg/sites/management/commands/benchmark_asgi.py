@@ -0,0 +1,32 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from sites.benchmarks import benchmark_asgi, benchmark_database
+
+class Command(BaseCommand):
+    help = 'Load the ASGI application with concurrent clients reading sites, with the sync and the async views'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=1000,
+                            help='Number of concurrent clients')
+        parser.add_argument('--requests', type=int, default=5,
+                            help='Number of requests sent by each client, one after the other')
+        parser.add_argument('--sites', type=int, default=1000,
+                            help='Number of synthetic sites read, created in a test database')
+        parser.add_argument('--client-delay', type=float, default=0,
+                            help='Seconds each client takes to read the body of a response')
+        parser.add_argument('--no-cache', action='store_false', dest='cache',
+                            help='Disable the cache of the sites, every request reads the database')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            results = benchmark_asgi(
+                clients=options['clients'],
+                requests=options['requests'],
+                sites=options['sites'],
+                client_delay=options['client_delay'],
+                cache=options['cache'],
+            )
+        self.stdout.write(json.dumps(results, indent=2))
+        errors = sum(result['errors'] for result in results)
+        if errors:
+            raise CommandError(f'{errors} requests were not answered with 200, see the statuses')
@@ -0,0 +1,22 @@
+import json
+from django.core.management.base import BaseCommand
+from sites.benchmarks import benchmark_classify
+
+class Command(BaseCommand):
+    help = 'Compare the batch classification of urls with a loop classifying one url at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--site-urls', type=int, default=100000,
+                            help='Number of urls of the synthetic sites')
+        parser.add_argument('--urls', type=int, default=1000000,
+                            help='Number of visited urls classified')
+        parser.add_argument('--batch-size', type=int, default=100000,
+                            help='Number of urls classified at once')
+
+    def handle(self, *args, **options):
+        result = benchmark_classify(
+            site_urls=options['site_urls'],
+            visited=options['urls'],
+            batch_size=options['batch_size'],
+        )
+        self.stdout.write(json.dumps(result, indent=2))
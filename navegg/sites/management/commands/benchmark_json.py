@@ -0,0 +1,16 @@
+import json
+from django.core.management.base import BaseCommand
+from sites.benchmarks import benchmark_json
+
+class Command(BaseCommand):
+    help = 'Compare the rendering and parsing of the sites by DRF and by sites.renderers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sites', type=int, nargs='+', default=[10000, 100000],
+                            help='Numbers of synthetic sites rendered and parsed')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Number of runs of each, the best one is reported')
+
+    def handle(self, *args, **options):
+        results = [benchmark_json(sites, options['repeat']) for sites in options['sites']]
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,19 @@
+import json
+from django.core.management.base import BaseCommand
+from sites.benchmarks import benchmark_database, benchmark_metrics
+
+class Command(BaseCommand):
+    help = 'Measure the time MetricsMiddleware adds to the requests of the cached views'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=10000,
+                            help='Number of requests of each run')
+        parser.add_argument('--sites', type=int, default=100,
+                            help='Number of synthetic sites read, created in a test database')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Number of runs of each, the best one is reported')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            results = benchmark_metrics(options['requests'], options['sites'], options['repeat'])
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,19 @@
+import json
+from django.core.management.base import BaseCommand
+from sites.benchmarks import benchmark_database, benchmark_serialize
+
+class Command(BaseCommand):
+    help = 'Compare the rendering of the sites by SitesSerializer and by the representation of the read endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sites', type=int, nargs='+', default=[10000, 100000],
+                            help='Numbers of synthetic sites rendered, created in a test database')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of sites rendered at once')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            results = [
+                benchmark_serialize(sites, options['chunk_size']) for sites in options['sites']
+            ]
+        self.stdout.write(json.dumps(results, indent=2))
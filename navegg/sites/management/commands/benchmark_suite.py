@@ -0,0 +1,56 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from sites.benchmarks import benchmark_database, compare_results, run_suite
+
+class Command(BaseCommand):
+    help = ('Benchmark the API and the import on synthetic catalogs of sites, '
+            'and compare the results with a baseline')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sites', type=int, nargs='+', default=[10000],
+                            help='Numbers of sites of the catalogs, like 10000 100000 1000000')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Number of requests to each endpoint')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed of the catalogs and of the requests')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of rows of the import inserted in each transaction')
+        parser.add_argument('--cache', action='store_true',
+                            help='Answer the reads from the cache of the sites')
+        parser.add_argument('--output', default=None,
+                            help='JSON file the results are written to, printed by default')
+        parser.add_argument('--baseline', default=None,
+                            help='JSON file of the results of an earlier run to compare with')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Fraction the times and the memory can be worse than the baseline')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or min(options['sites']) < 1:
+            raise CommandError('The sites and the requests must be at least 1')
+        baseline = None
+        if options['baseline'] is not None:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        with benchmark_database():
+            results = run_suite(
+                catalogs=options['sites'],
+                requests=options['requests'],
+                seed=options['seed'],
+                chunk_size=options['chunk_size'],
+                cache=options['cache'],
+            )
+        output = json.dumps(results, indent=2)
+        if options['output'] is None:
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+
+        if baseline is not None:
+            regressions = compare_results(results, baseline, options['threshold'])
+            for regression in regressions:
+                self.stderr.write(regression)
+            if regressions:
+                raise CommandError(f'{len(regressions)} regressions against the baseline')
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
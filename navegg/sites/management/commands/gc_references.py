@@ -0,0 +1,52 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from sites.maintenance import REFERENCE_LINKS, collect_references
+
+class Command(BaseCommand):
+    help = 'Remove the urls and categories linked to no site, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of urls or categories removed in each transaction')
+        parser.add_argument('--pause', type=float, default=0.1,
+                            help='Seconds between the batches')
+        parser.add_argument('--max-seconds', type=float, default=None,
+                            help='Stop each run after the seconds')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Count the urls and categories without removing them')
+        parser.add_argument('--loop', type=float, default=None, metavar='SECONDS',
+                            help='Run again after the seconds, until interrupted')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('The batch size must be at least 1')
+
+        try:
+            while True:
+                self.collect(options)
+                if options['loop'] is None:
+                    break
+                time.sleep(options['loop'])
+        except KeyboardInterrupt:
+            pass
+
+    def collect(self, options):
+        start = time.monotonic()
+        should_stop = None
+        if options['max_seconds'] is not None:
+            should_stop = lambda: time.monotonic() - start >= options['max_seconds']
+
+        for model, (_, _, name) in REFERENCE_LINKS.items():
+            removed, reclaimed = collect_references(
+                model,
+                batch_size=options['batch_size'],
+                pause=options['pause'],
+                should_stop=should_stop,
+                dry_run=options['dry_run'],
+                log=self.stdout.write,
+            )
+            action = 'Found' if options['dry_run'] else 'Removed'
+            self.stdout.write(self.style.SUCCESS(
+                f'{action} {removed} {name} linked to no site, {reclaimed} bytes of descriptions '
+                f'in {time.monotonic() - start:.2f}s'
+            ))
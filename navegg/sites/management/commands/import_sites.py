@@ -0,0 +1,36 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from sites.loader import BulkLoader, load_parallel
+from sites.parsing import read_records
+
+class Command(BaseCommand):
+    help = 'Import a sites CSV file, parsing it in parallel worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file with the columns name, urls, categories, status')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of processes parsing the file')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of rows inserted in each transaction')
+        parser.add_argument('--checkpoint', default=None,
+                            help='File used to resume an interrupted import')
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options['path']):
+            raise CommandError(f'File {options["path"]} does not exist')
+        if options['workers'] < 1:
+            raise CommandError('At least one worker is required')
+
+        loader = BulkLoader(
+            chunk_size=options['chunk_size'],
+            checkpoint=options['checkpoint'],
+            log=self.stdout.write,
+        )
+        if options['workers'] == 1:
+            rows = loader.load(read_records(options['path']))
+        else:
+            rows = load_parallel(options['path'], loader, options['workers'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {rows} rows: {loader.created} sites created, {loader.skipped} skipped'
+        ))
@@ -0,0 +1,42 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from sites.maintenance import prune_changes
+
+class Command(BaseCommand):
+    help = 'Remove the changes made some days ago from the log of the change feed, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=None,
+                            help='Days the changes are kept, SITES_CHANGES_RETENTION_DAYS by default')
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Number of changes removed in each transaction')
+        parser.add_argument('--pause', type=float, default=0.5,
+                            help='Seconds between the batches')
+        parser.add_argument('--max-seconds', type=float, default=None,
+                            help='Stop after the seconds, to keep the pruning in the off-peak hours')
+
+    def handle(self, *args, **options):
+        days = options['days']
+        if days is None:
+            days = getattr(settings, 'SITES_CHANGES_RETENTION_DAYS', 7)
+        if days < 0:
+            raise CommandError('The days must not be negative')
+        if options['batch_size'] < 1:
+            raise CommandError('The batch size must be at least 1')
+
+        should_stop = None
+        if options['max_seconds'] is not None:
+            deadline = time.monotonic() + options['max_seconds']
+            should_stop = lambda: time.monotonic() >= deadline
+
+        pruned = prune_changes(
+            timezone.now() - timedelta(days=days),
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            should_stop=should_stop,
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Pruned {pruned} changes'))
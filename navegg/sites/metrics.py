@@ -0,0 +1,285 @@
+import logging
+import threading
+from bisect import bisect_left
+from random import random
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Metrics of the requests answered by the process, recorded by
+# MetricsMiddleware and exposed at /metrics in the text format of Prometheus.
+# Each view and method has histograms of the time of the requests, the number
+# and time of their queries, the time building the representation of the
+# sites and the size of the responses. Like the cache, they're kept in the
+# memory of each process, every worker is scraped on its own
+
+slow_request_logger = logging.getLogger('sites.slow_requests')
+
+# Upper bounds of the buckets of the histograms, the last bucket is +Inf
+SECONDS_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+QUERIES_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BYTES_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+# Methods labelled by their name in the metrics, the others are 'other'
+METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE', 'CONNECT'))
+
+# Maximum number of statements kept for the log of a slow request
+MAX_SLOW_STATEMENTS = 100
+
+# The histograms of each view: name, help and buckets
+HISTOGRAMS = (
+    ('navegg_request_duration_seconds', 'Time answering the requests', SECONDS_BUCKETS),
+    ('navegg_request_queries', 'Database queries run by each request', QUERIES_BUCKETS),
+    ('navegg_request_query_seconds', 'Time of the database queries of each request',
+     SECONDS_BUCKETS),
+    ('navegg_request_serialize_seconds', 'Time building the representation of the sites',
+     SECONDS_BUCKETS),
+    ('navegg_response_size_bytes', 'Size of the bodies of the responses, not streamed',
+     BYTES_BUCKETS),
+)
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Return the cumulative (upper bound, count) of each bucket, like Prometheus
+    def cumulative(self):
+        total = 0
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            total += count
+            yield bound, total
+
+# The histograms of one view and method, and the number of responses by status
+class ViewMetrics:
+
+    def __init__(self):
+        self.histograms = tuple(Histogram(buckets) for _, _, buckets in HISTOGRAMS)
+        self.statuses = {}
+
+    # Histogram.observe inlined, it runs for every request
+    def observe(self, status_code, values):
+        for histogram, value in zip(self.histograms, values):
+            if value is not None:
+                histogram.counts[bisect_left(histogram.buckets, value)] += 1
+                histogram.sum += value
+                histogram.count += 1
+        statuses = self.statuses
+        statuses[status_code] = statuses.get(status_code, 0) + 1
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.views = {}
+        self.lock = threading.Lock()
+
+    # Add the values of one request, in the order of HISTOGRAMS, None when
+    # the request has no value for the histogram
+    def observe(self, view, method, status_code, values):
+        with self.lock:
+            metrics = self.views.get((view, method))
+            if metrics is None:
+                metrics = self.views[(view, method)] = ViewMetrics()
+            metrics.observe(status_code, values)
+
+    def clear(self):
+        with self.lock:
+            self.views.clear()
+
+    # Return the metrics in the text format of Prometheus
+    def export(self):
+        lines = []
+        with self.lock:
+            views = sorted(self.views.items())
+            for index, (name, description, _) in enumerate(HISTOGRAMS):
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} histogram')
+                for (view, method), metrics in views:
+                    histogram = metrics.histograms[index]
+                    if histogram.count == 0:
+                        continue
+                    labels = f'view="{view}",method="{method}"'
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                    lines.append(f'{name}_sum{{{labels}}} {histogram.sum:.9g}')
+                    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+            lines.append('# HELP navegg_responses_total Responses by view, method and status')
+            lines.append('# TYPE navegg_responses_total counter')
+            for (view, method), metrics in views:
+                for status_code, count in sorted(metrics.statuses.items()):
+                    lines.append(
+                        f'navegg_responses_total{{view="{view}",method="{method}",'
+                        f'status="{status_code}"}} {count}'
+                    )
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+# What one request did, filled by the wrapper of the queries and the
+# functions timed with timed_serialize
+class RequestRecord:
+    __slots__ = ('queries', 'query_seconds', 'serialize_seconds', 'statements')
+
+    def __init__(self, keep_statements):
+        self.queries = 0
+        self.query_seconds = 0
+        self.serialize_seconds = None
+        # The SQL and seconds of each query, only kept for the sampled requests
+        self.statements = [] if keep_statements else None
+
+    # Wrapper of the queries, see connection.execute_wrapper
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            seconds = perf_counter() - start
+            self.queries += 1
+            self.query_seconds += seconds
+            if self.statements is not None and len(self.statements) < MAX_SLOW_STATEMENTS:
+                self.statements.append((sql, seconds))
+
+_current_record = ContextVar('sites_metrics_record', default=None)
+
+# Wrapper of the queries of every connection, adding them to the record of
+# the request running them. The connections are kept by thread, and under
+# ASGI the views run in the thread of sync_to_async, which copies the
+# context of the request with its record
+def record_query(execute, sql, params, many, context):
+    record = _current_record.get()
+    if record is None:
+        return execute(sql, params, many, context)
+    return record(execute, sql, params, many, context)
+
+@receiver(connection_created)
+def add_query_wrapper(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+# Add the time of the function to the serialize time of the current request
+def timed_serialize(function):
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        record = _current_record.get()
+        if record is None:
+            return function(*args, **kwargs)
+        start = perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record.serialize_seconds = (record.serialize_seconds or 0) + perf_counter() - start
+    return wrapper
+
+# Return the method of the request for the method label, the ones outside
+# METHODS are counted together so clients can't add series at will
+def method_label(request):
+    return request.method if request.method in METHODS else 'other'
+
+# The name of the view class answering the request, or of the function
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    view_class = getattr(match.func, 'view_class', None)
+    if view_class is not None:
+        return view_class.__name__
+    return getattr(match.func, '__name__', 'unknown')
+
+_options = None
+
+# The options of SITES_METRICS, read once per process
+def get_options():
+    global _options
+    if _options is None:
+        options = getattr(settings, 'SITES_METRICS', {})
+        _options = (
+            options.get('ENABLED', True),
+            options.get('SLOW_REQUEST_SECONDS', 1),
+            options.get('SLOW_REQUEST_SAMPLE_RATE', 0),
+        )
+    return _options
+
+@receiver(setting_changed)
+def reset_options(setting, **kwargs):
+    global _options
+    if setting == 'SITES_METRICS':
+        _options = None
+
+# Runs in the chain of middleware of both the WSGI and the ASGI handlers,
+# without a switch to a thread of its own under ASGI. The work added to each
+# request is kept small, it runs on every one, and the SQL is only kept for
+# the sampled requests
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        enabled, slow_seconds, sample_rate = get_options()
+        if not enabled:
+            return self.get_response(request)
+
+        record = RequestRecord(keep_statements=sample_rate > 0 and random() < sample_rate)
+        token = _current_record.set(record)
+        start = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_record.reset(token)
+        observe_request(request, response, record, perf_counter() - start, slow_seconds)
+        return response
+
+    async def __acall__(self, request):
+        enabled, slow_seconds, sample_rate = get_options()
+        if not enabled:
+            return await self.get_response(request)
+
+        record = RequestRecord(keep_statements=sample_rate > 0 and random() < sample_rate)
+        token = _current_record.set(record)
+        start = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_record.reset(token)
+        observe_request(request, response, record, perf_counter() - start, slow_seconds)
+        return response
+
+def observe_request(request, response, record, seconds, slow_seconds):
+    registry.observe(view_name(request), method_label(request), response.status_code, (
+        seconds, record.queries, record.query_seconds, record.serialize_seconds,
+        None if response.streaming else len(response.content),
+    ))
+    if record.statements is not None and seconds >= slow_seconds:
+        log_slow_request(request, response, seconds, record)
+
+def log_slow_request(request, response, seconds, record):
+    statements = '\n'.join(
+        f'  {statement_seconds * 1000:.1f}ms {sql}' for sql, statement_seconds in record.statements
+    )
+    slow_request_logger.warning(
+        '%s %s %s in %.1fms, %d queries in %.1fms\n%s',
+        request.method, request.get_full_path(), response.status_code, seconds * 1000,
+        record.queries, record.query_seconds * 1000, statements,
+    )
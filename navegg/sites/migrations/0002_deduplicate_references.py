@@ -0,0 +1,47 @@
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+# Merge the categories and urls with the same description into the one with
+# the lowest id, moving the links of the sites to it
+def deduplicate(apps, schema_editor):
+    Sites = apps.get_model('sites', 'Sites')
+    for field_name in ('url', 'category'):
+        field = Sites._meta.get_field(field_name)
+        model = field.related_model
+        through = field.remote_field.through
+        reference_column = f'{model._meta.model_name}_id'
+
+        duplicates = (
+            model.objects.values('description')
+            .annotate(keep=Min('id'), total=Count('id'))
+            .filter(total__gt=1)
+        )
+        for duplicate in duplicates:
+            keep = duplicate['keep']
+            removed = list(
+                model.objects.filter(description=duplicate['description'])
+                .exclude(id=keep)
+                .values_list('id', flat=True)
+            )
+            for reference_id in removed:
+                # Drop the links of sites already linked to the kept object
+                linked = through.objects.filter(**{reference_column: keep}).values('sites_id')
+                through.objects.filter(
+                    **{reference_column: reference_id, 'sites_id__in': linked}
+                ).delete()
+                through.objects.filter(**{reference_column: reference_id}).update(
+                    **{reference_column: keep}
+                )
+            model.objects.filter(id__in=removed).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sites', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sites', '0002_deduplicate_references'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sitecategory',
+            name='description',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='siteurl',
+            name='description',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sites', '0003_unique_descriptions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sites',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='sites',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
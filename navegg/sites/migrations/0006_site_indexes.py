@@ -0,0 +1,104 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Frozen copy of sites.normalize.url_host, so the migration keeps filling
+# the hosts it filled when it was written
+def url_host(url):
+    url = url.strip()
+    scheme = url.find('://')
+    if scheme != -1:
+        url = url[scheme + 3:]
+    for separator in '/?#':
+        url = url.split(separator, 1)[0]
+    host = url.rsplit('@', 1)[-1].lower()
+    if host.startswith('['):
+        # IPv6 address, the port is after the bracket
+        host = host[:host.find(']') + 1]
+    else:
+        host = host.split(':', 1)[0]
+    host = host.rstrip('.')
+    if host.startswith('www.'):
+        host = host[4:]
+    return host
+
+
+# Fill the host of the existing urls
+def fill_hosts(apps, schema_editor):
+    SiteURL = apps.get_model('sites', 'SiteURL')
+    urls = []
+    for url in SiteURL.objects.only('id', 'description').iterator():
+        url.host = url_host(url.description)
+        urls.append(url)
+        if len(urls) == 1000:
+            SiteURL.objects.bulk_update(urls, ['host'])
+            urls = []
+    SiteURL.objects.bulk_update(urls, ['host'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sites', '0005_site_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='siteurl',
+            name='host',
+            field=models.CharField(db_index=True, default='', max_length=100),
+        ),
+        migrations.RunPython(fill_hosts, migrations.RunPython.noop),
+        # The links keep the tables created for the relations, only the
+        # state changes to the explicit models
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='SiteURLLink',
+                    fields=[
+                        ('id', models.AutoField(primary_key=True, serialize=False)),
+                        ('sites', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sites.Sites')),
+                        ('siteurl', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sites.SiteURL')),
+                    ],
+                    options={
+                        'db_table': 'sites_sites_url',
+                        'unique_together': {('sites', 'siteurl')},
+                    },
+                ),
+                migrations.CreateModel(
+                    name='SiteCategoryLink',
+                    fields=[
+                        ('id', models.AutoField(primary_key=True, serialize=False)),
+                        ('sites', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sites.Sites')),
+                        ('sitecategory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sites.SiteCategory')),
+                    ],
+                    options={
+                        'db_table': 'sites_sites_category',
+                        'unique_together': {('sites', 'sitecategory')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='sites',
+                    name='url',
+                    field=models.ManyToManyField(related_name='url', through='sites.SiteURLLink', to='sites.SiteURL'),
+                ),
+                migrations.AlterField(
+                    model_name='sites',
+                    name='category',
+                    field=models.ManyToManyField(related_name='category', through='sites.SiteCategoryLink', to='sites.SiteCategory'),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='sites',
+            index=models.Index(fields=['active', 'id'], name='sites_active_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='siteurllink',
+            index=models.Index(fields=['siteurl', 'sites'], name='sites_url_siteurl_sites_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sitecategorylink',
+            index=models.Index(fields=['sitecategory', 'sites'], name='sites_category_sites_idx'),
+        ),
+    ]
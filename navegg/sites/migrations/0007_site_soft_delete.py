@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sites', '0006_site_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sites',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.AlterField(
+            model_name='sites',
+            name='name',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='sites',
+            index=models.Index(condition=models.Q(('active', True), ('deleted_at__isnull', True)), fields=['id'], name='sites_listed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sites',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='sites_deleted_at_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='sites',
+            constraint=models.UniqueConstraint(condition=models.Q(('deleted_at__isnull', True)), fields=('name',), name='sites_unique_name'),
+        ),
+    ]
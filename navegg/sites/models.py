@@ -1,22 +1,234 @@
-from django.db import models
+from django.db import connections, models
+from django.utils import timezone
+from sites.normalize import url_host
+
+# Manager of the categories and urls, which are identified by the description
+class ReferenceManager(models.Manager):
+
+    # Return a new unsaved object with the description
+    def build(self, description):
+        return self.model(description=description)
+
+    # Return the objects with the descriptions, in the same order, creating
+    # the ones that don't exist. The insert ignores the descriptions created
+    # in the meantime, so concurrent requests can't create duplicates
+    def resolve(self, descriptions):
+        descriptions = list(dict.fromkeys(descriptions))
+        objects = {
+            reference.description: reference
+            for reference in self.filter(description__in=descriptions)
+        }
+        missing = [description for description in descriptions if description not in objects]
+        if missing:
+            objects.update(
+                (reference.description, reference) for reference in self.create_missing(missing)
+            )
+        return [objects[description] for description in descriptions]
+
+    # Create the objects with the descriptions and return them, with the ones
+    # other transactions created in the meantime. Where the database returns
+    # the rows of an insert (PostgreSQL, SQLite 3.35+) it's a single
+    # INSERT ... ON CONFLICT (description) DO UPDATE ... RETURNING id, which
+    # returns the ids of both. Otherwise the conflicts are ignored and the
+    # objects are read back
+    def create_missing(self, descriptions, batch_size=None):
+        descriptions = list(descriptions)
+        references = [self.build(description) for description in descriptions]
+        features = connections[self.db].features
+        if features.can_return_rows_from_bulk_insert and features.supports_update_conflicts_with_target:
+            return self.bulk_create(
+                references, batch_size=batch_size, update_conflicts=True,
+                unique_fields=['description'], update_fields=['description'],
+            )
+        self.bulk_create(references, batch_size=batch_size, ignore_conflicts=True)
+        # Read back in batches below the limit of variables in a query
+        size = connections[self.db].ops.bulk_batch_size(['description'], references)
+        return [
+            reference
+            for start in range(0, len(descriptions), size)
+            for reference in self.filter(description__in=descriptions[start:start + size])
+        ]
 
 class SiteCategory(models.Model):
     id = models.AutoField(primary_key=True)
-    description = models.CharField(null=False, max_length=100)
+    description = models.CharField(null=False, max_length=100, unique=True)
+
+    objects = ReferenceManager()
 
     def __str__(self):
         return f'{self.description}'
 
+class SiteURLManager(ReferenceManager):
+
+    # The bulk inserts don't call save, the host is set when building the url
+    def build(self, description):
+        return self.model(description=description, host=url_host(description))
+
 class SiteURL(models.Model):
     id = models.AutoField(primary_key=True)
-    description = models.CharField(null=False, max_length=100)
+    description = models.CharField(null=False, max_length=100, unique=True)
+    # Host of the description, to search the sites by host
+    host = models.CharField(max_length=100, db_index=True, default='')
+
+    objects = SiteURLManager()
+
+    def save(self, *args, **kwargs):
+        self.host = url_host(self.description)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'host'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f'{self.description}'
 
+class SitesQuerySet(models.QuerySet):
+
+    # Increase the version of the sites, used when they change without being
+    # saved, like when the urls or categories linked to them change
+    def touch(self):
+        return self.update(version=models.F('version') + 1, updated_at=timezone.now())
+
+    def active(self):
+        return self.filter(active=True)
+
+    # Mark the sites as deleted without removing their rows and links, like
+    # Sites.soft_delete. The caller sends the change of the sites
+    def soft_delete(self):
+        now = timezone.now()
+        return self.update(deleted_at=now, version=models.F('version') + 1, updated_at=now)
+
+# The default manager of the sites leaves out the deleted ones, which are
+# only read by Sites.all_objects
+class SitesManager(models.Manager.from_queryset(SitesQuerySet)):
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+# The constraint of the names of the sites not deleted
+UNIQUE_NAME = 'sites_unique_name'
+
 class Sites(models.Model):
     id = models.AutoField(primary_key=True)
-    name = models.CharField(null=False, max_length=100, unique=True)
+    # Unique among the sites not deleted, see Meta.constraints
+    name = models.CharField(null=False, max_length=100)
     active = models.BooleanField(default=True)
-    url = models.ManyToManyField(SiteURL, related_name='url')
-    category = models.ManyToManyField(SiteCategory, related_name='category')
\ No newline at end of file
+    url = models.ManyToManyField(SiteURL, related_name='url', through='SiteURLLink')
+    category = models.ManyToManyField(
+        SiteCategory, related_name='category', through='SiteCategoryLink'
+    )
+    # Increased on every change of the site, its urls or its categories
+    version = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Time the site was deleted when SITES_SOFT_DELETE is set. The deleted
+    # sites keep their rows until `manage.py purge_sites` removes them
+    deleted_at = models.DateTimeField(null=True, blank=True, default=None)
+
+    objects = SitesManager()
+    all_objects = SitesQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Filter by active and page by id with a single index range
+            models.Index(fields=['active', 'id'], name='sites_active_id_idx'),
+            # The pages listed by default, only the rows of the active sites
+            models.Index(
+                fields=['id'], name='sites_listed_idx',
+                condition=models.Q(active=True, deleted_at__isnull=True),
+            ),
+            # The deleted sites, read by the purge
+            models.Index(
+                fields=['deleted_at'], name='sites_deleted_at_idx',
+                condition=models.Q(deleted_at__isnull=False),
+            ),
+        ]
+        constraints = [
+            # A deleted site doesn't keep its name from a new site
+            models.UniqueConstraint(
+                fields=['name'], name=UNIQUE_NAME,
+                condition=models.Q(deleted_at__isnull=True),
+            ),
+        ]
+
+    # Every save increases the version, in the database so concurrent
+    # changes always get different versions
+    def save(self, *args, **kwargs):
+        updating = not self._state.adding
+        if updating:
+            self.version = models.F('version') + 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'updated_at'}
+        super().save(*args, **kwargs)
+        if updating:
+            # The version increased by the database, for the ETag
+            self.refresh_from_db(fields=['version'])
+
+    # Mark the site as deleted, it's left out of the default manager and sent
+    # as deleted to the change feed
+    def soft_delete(self):
+        self.deleted_at = timezone.now()
+        self.save(update_fields=['deleted_at'])
+
+    # Strong validator of the representation of the site. The time of the
+    # last change is part of it because the ids of deleted sites can be reused
+    @property
+    def etag(self):
+        return f'"{self.id}-{self.version}-{int(self.updated_at.timestamp() * 1000000)}"'
+
+# Whether the error of the database is the violation of the unique name of
+# the sites: by the name of the constraint in the diagnostics of psycopg, or
+# in the message of the other databases. SQLite only names the column
+def violates_unique_name(error):
+    diag = getattr(error.__cause__, 'diag', None)
+    if diag is not None:
+        return diag.constraint_name == UNIQUE_NAME
+    message = str(error)
+    return UNIQUE_NAME in message or f'{Sites._meta.db_table}.name' in message
+
+# The links of the sites to the urls and categories, in the tables Django
+# created for the relations. The unique constraint covers the lookups from the
+# site and the indexes the lookups from the url or category, both index only
+
+class LinkQuerySet(models.QuerySet):
+
+    # The links of the sites active and not deleted
+    def active(self):
+        return self.filter(sites__active=True, sites__deleted_at__isnull=True)
+
+class SiteURLLink(models.Model):
+    id = models.AutoField(primary_key=True)
+    sites = models.ForeignKey(Sites, on_delete=models.CASCADE)
+    siteurl = models.ForeignKey(SiteURL, on_delete=models.CASCADE)
+
+    objects = LinkQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'sites_sites_url'
+        unique_together = [('sites', 'siteurl')]
+        indexes = [models.Index(fields=['siteurl', 'sites'], name='sites_url_siteurl_sites_idx')]
+
+class SiteCategoryLink(models.Model):
+    id = models.AutoField(primary_key=True)
+    sites = models.ForeignKey(Sites, on_delete=models.CASCADE)
+    sitecategory = models.ForeignKey(SiteCategory, on_delete=models.CASCADE)
+
+    objects = LinkQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'sites_sites_category'
+        unique_together = [('sites', 'sitecategory')]
+        indexes = [
+            models.Index(fields=['sitecategory', 'sites'], name='sites_category_sites_idx'),
+        ]
+
+# Log of the changes of the sites, read by the change feed. The id of the
+# site is not a foreign key so the log keeps the sites that were deleted
+class SiteChange(models.Model):
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ACTIONS = [(CREATED, 'Created'), (UPDATED, 'Updated'), (DELETED, 'Deleted')]
+
+    id = models.BigAutoField(primary_key=True)
+    site_id = models.IntegerField()
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    created_at = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,61 @@
+# Normalization of the urls of the sites. This module doesn't import Django
+# so it can run in the worker processes of the import
+
+# Split the url in its host, in lower case and without the scheme, the user,
+# the port and the leading "www.", and its path, without the query, the
+# fragment and the empty segments
+def split_url(url):
+    url = url.strip()
+    scheme = url.find('://')
+    if scheme != -1:
+        url = url[scheme + 3:]
+    for separator in '?#':
+        url = url.split(separator, 1)[0]
+    host, _, path = url.partition('/')
+
+    host = host.rsplit('@', 1)[-1].lower()
+    if host.startswith('['):
+        # IPv6 address, the port is after the bracket
+        host = host[:host.find(']') + 1]
+    else:
+        host = host.split(':', 1)[0]
+    host = host.rstrip('.')
+    if host.startswith('www.'):
+        host = host[4:]
+    return host, '/'.join(segment for segment in path.split('/') if segment)
+
+# Return the host of the url, like "car.com" for
+# "https://www.Car.com:443/models?page=1"
+def url_host(url):
+    return split_url(url)[0]
+
+# Return the url as host and path, like "car.com/news/123" for
+# "https://www.car.com/news/123/?x=1"
+def normalize_url(url):
+    host, path = split_url(url)
+    return f'{host}/{path}' if path else host
+
+# Yield the normalized url and the shorter urls it's under, from the longest:
+# the url cut at each slash and then the host without each of its first
+# labels, like "car.com/news", "car.com" and "com" for "www.car.com/news/"
+def url_candidates(url):
+    candidate = normalize_url(url)
+    while candidate:
+        yield candidate
+        if '/' in candidate:
+            candidate = candidate.rpartition('/')[0]
+        else:
+            candidate = candidate.partition('.')[2]
+
+# Return the segments of the url from the most general one: the labels of
+# the host from the top level domain and then the segments of the path, so a
+# url is under another when the segments of the other are a prefix of its own.
+# The path starts with a '/' segment, which no label or segment can be, so a
+# subdomain isn't taken for a path (news.car.com for car.com/news)
+def url_segments(url):
+    host, path = split_url(url)
+    segments = host.split('.')[::-1]
+    if path:
+        segments.append('/')
+        segments.extend(path.split('/'))
+    return segments
@@ -0,0 +1,78 @@
+from operator import attrgetter
+from django.conf import settings
+from rest_framework import serializers
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# Read a positive integer from the query parameters
+def get_int_param(request, name, default):
+    value = request.query_params.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise serializers.ValidationError({name: 'A valid integer is required'})
+    if value < 0:
+        raise serializers.ValidationError({name: 'A positive integer is required'})
+    return value
+
+# Keyset pagination on Sites.id, the page is the rows after the id passed
+# in the cursor so each page is an index range scan no matter how deep it is
+class SitesKeysetPagination:
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def __init__(self):
+        self.page_size = getattr(settings, 'SITES_PAGE_SIZE', 100)
+        self.max_page_size = getattr(settings, 'SITES_MAX_PAGE_SIZE', 1000)
+        self.next_cursor = None
+        self.request = None
+
+    def get_cursor(self, request):
+        return get_int_param(request, self.cursor_query_param, 0)
+
+    def get_page_size(self, request):
+        page_size = get_int_param(request, self.page_size_query_param, self.page_size)
+        if page_size == 0:
+            raise serializers.ValidationError({self.page_size_query_param: 'A positive integer is required'})
+        return min(page_size, self.max_page_size)
+
+    # Return the sites of the requested page
+    def paginate_queryset(self, queryset, request):
+        self.request = request
+        cursor = self.get_cursor(request)
+        page_size = self.get_page_size(request)
+
+        # Fetch one extra row to know if there is a next page
+        page = list(queryset.filter(id__gt=cursor).order_by('id')[:page_size + 1])
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_cursor = page[-1].id
+        return page
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    # The body keeps being a list of sites, the next page goes in the Link header
+    def get_paginated_response(self, data):
+        headers = {}
+        next_link = self.get_next_link()
+        if next_link is not None:
+            headers['Link'] = f'<{next_link}>; rel="next"'
+        return Response(data, headers=headers)
+
+# Iterate over the queryset in chunks ordered by id, starting after the cursor.
+# get_id returns the id of a row, for querysets of values
+def iterate_chunks(queryset, chunk_size, cursor=0, get_id=attrgetter('id')):
+    while True:
+        chunk = list(queryset.filter(id__gt=cursor).order_by('id')[:chunk_size])
+        if len(chunk) == 0:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        cursor = get_id(chunk[-1])
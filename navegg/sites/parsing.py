@@ -0,0 +1,73 @@
+import csv
+import os
+
+# Parsing of the sites CSV ("name","urls","categories","status"). This module
+# doesn't import Django so it can run in the worker processes of the import
+
+# Split a list field of the CSV ("a;b;c"), ignoring empty and repeated values
+def split_list(value):
+    items = []
+    for item in value.split(';'):
+        item = item.strip()
+        if item and item not in items:
+            items.append(item)
+    return items
+
+# Convert a row of the sites CSV to (name, active, urls, categories)
+def parse_row(row):
+    return (row[0], row[3] == 'active', split_list(row[1]), split_list(row[2]))
+
+# Yield the parsed rows of a sites CSV file, skipping the header
+def read_records(path):
+    with open(path, newline='') as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=',')
+        next(csv_reader, None)
+        for row in csv_reader:
+            if row:
+                yield parse_row(row)
+
+# Split the file in byte ranges of about shard_size bytes, each range starts
+# at the beginning of a line and the header line is left out. Rows with line
+# breaks inside quoted fields are not supported
+def shard_ranges(path, shard_size):
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as csv_file:
+        csv_file.readline()
+        start = csv_file.tell()
+        while start < size:
+            csv_file.seek(min(start + shard_size, size))
+            # Move the end to the beginning of the next line
+            if csv_file.tell() < size:
+                csv_file.readline()
+            end = csv_file.tell()
+            ranges.append((path, start, end))
+            start = end
+    return ranges
+
+# Yield the raw rows of the byte range
+def read_range(path, start, end):
+    with open(path, 'rb') as csv_file:
+        csv_file.seek(start)
+        lines = []
+        while csv_file.tell() < end:
+            line = csv_file.readline()
+            if not line:
+                break
+            lines.append(line.decode('utf-8'))
+    for row in csv.reader(lines, delimiter=','):
+        if row:
+            yield row
+
+# Return the parsed rows of the byte range
+def parse_range(shard):
+    return [parse_row(row) for row in read_range(*shard)]
+
+# Return the distinct URLs and categories of the byte range, in file order
+def collect_vocabulary(shard):
+    urls = {}
+    categories = {}
+    for name, active, row_urls, row_categories in map(parse_row, read_range(*shard)):
+        urls.update(dict.fromkeys(row_urls))
+        categories.update(dict.fromkeys(row_categories))
+    return list(urls), list(categories)
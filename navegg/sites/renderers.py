@@ -0,0 +1,102 @@
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+from sites.representation import columnar_sites
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# JSON renderer and parser of the API using orjson when it's installed, and
+# the json module of DRF otherwise. The output is the same JSON as DRF's
+# JSONRenderer: compact, UTF-8 and with the dates, decimals and lazy strings
+# encoded by DRF's encoder. The settings orjson can't follow (an indent,
+# ensure_ascii or non compact separators) and the values it can't encode,
+# like integers over 64 bits, fall back to DRF. Unlike DRF, orjson encodes
+# NaN and infinite floats as null instead of failing
+
+ORJSON_OPTIONS = (
+    orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+)
+
+# The separators JavaScript doesn't allow in strings, escaped like DRF
+LINE_SEPARATORS = (('\u2028'.encode(), b'\\u2028'), ('\u2029'.encode(), b'\\u2029'))
+
+_encoder = encoders.JSONEncoder()
+
+# Return the JSON of the data as bytes, compact like the renderer
+def encode_json(data, newline=False):
+    if orjson is not None:
+        try:
+            content = orjson.dumps(
+                data, default=_encoder.default,
+                option=ORJSON_OPTIONS | (orjson.OPT_APPEND_NEWLINE if newline else 0),
+            )
+        except orjson.JSONEncodeError:
+            content = None
+        if content is not None:
+            for separator, escaped in LINE_SEPARATORS:
+                if separator in content:
+                    content = content.replace(separator, escaped)
+            return content
+    content = JSONRenderer().render(data)
+    return content + b'\n' if newline else content
+
+class FastJSONRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or not self.compact or self.ensure_ascii
+                or self.get_indent(accepted_media_type or '', renderer_context or {})):
+            return super().render(data, accepted_media_type, renderer_context)
+        return encode_json(data)
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            data = stream.read()
+            if encoding.lower().replace('-', '') != 'utf8':
+                data = data.decode(encoding)
+            return orjson.loads(data)
+        except (ValueError, LookupError) as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+# MessagePack of the data, with the strings as str and the bytes as bin.
+# It's only offered by the views when the msgpack package is installed
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, use_bin_type=True, default=_encoder.default)
+
+# JSON of a list of sites in columns, see columnar_sites. Other data, like
+# the errors, is rendered as JSON as it is
+class ColumnarRenderer(BaseRenderer):
+    media_type = 'application/vnd.navegg.columnar+json'
+    format = 'columnar'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, list):
+            data = columnar_sites(data)
+        return encode_json(data)
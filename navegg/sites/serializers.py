@@ -1,7 +1,21 @@
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
-from sites.models import Sites, SiteCategory, SiteURL
-
-class SiteCategorySerializer(serializers.ModelSerializer):
+from sites.models import Sites, SiteCategory, SiteURL, violates_unique_name
+from sites.signals import batch_changes
+
+# The description of the urls and categories is required in the PATCH of a
+# site too, where the fields of the site are optional (partial) and so are
+# the fields nested in it
+class DescriptionRequiredMixin:
+
+    def validate(self, attrs):
+        if 'description' not in attrs:
+            raise serializers.ValidationError(
+                {'description': [self.fields['description'].error_messages['required']]}
+            )
+        return attrs
+
+class SiteCategorySerializer(DescriptionRequiredMixin, serializers.ModelSerializer):
     id = serializers.IntegerField(read_only=True)
     description = serializers.CharField(required=True, max_length=100)   
 
@@ -17,7 +31,7 @@ class SiteCategorySerializer(serializers.ModelSerializer):
         model = SiteCategory
         fields = ['id', 'description']
 
-class SiteURLSerializer(serializers.ModelSerializer):
+class SiteURLSerializer(DescriptionRequiredMixin, serializers.ModelSerializer):
     id = serializers.IntegerField(read_only=True)
     description = serializers.CharField(required=True, max_length=100)
 
@@ -46,103 +60,96 @@ class SitesSerializer(serializers.ModelSerializer):
 
     # Create the category or url for the sites if necessary
     def handle_reference(self, instance, reference_instance, data_list):
-        for data in data_list:
-            description = data['description']
-            # Verify if the category or url already exists, if not exists create a new
-            # if exist find the object
-            if not reference_instance.objects.filter(description=description).exists():
-                reference_object = reference_instance.objects.create(description=description)
-            else:
-                reference_object = reference_instance.objects.get(description=description)
-
-            # Add the searched/created object to the Site reference
-            if reference_instance.__name__ == 'SiteCategory':
-                instance.category.add(reference_object)
-            elif reference_instance.__name__ == 'SiteURL':
-                instance.url.add(reference_object)
+        # Find the categories or urls, creating the ones that don't exist
+        reference_objects = reference_instance.objects.resolve(
+            data['description'] for data in data_list
+        )
+
+        # Add the searched/created objects to the Site reference
+        if reference_instance.__name__ == 'SiteCategory':
+            instance.category.add(*reference_objects)
+        elif reference_instance.__name__ == 'SiteURL':
+            instance.url.add(*reference_objects)
+
+    # Check the urls and categories in the request have at least one item
+    def validate_references(self, validated_data):
+        errors = { 'errors': []}
+
+        if 'url' in validated_data and len(validated_data['url']) == 0:
+            errors['errors'].append({'url': 'At least one URL is required'})
+
+        if 'category' in validated_data and len(validated_data['category']) == 0:
+            errors['errors'].append({'category': 'At least one Category is required'})
+
+        if len(errors['errors']) > 0:
+            raise serializers.ValidationError(errors)
 
     def create(self, validated_data):
 
         if Sites.objects.filter(name=validated_data['name']).exists():
             raise serializers.ValidationError({'name': 'This name already exists'})
 
+        self.validate_references(validated_data)
+
         site = Sites()
         site.name = validated_data['name']
         if 'active' in validated_data:
             site.active = validated_data['active']
 
-        # Save the site to be able to link the category and url to the site
-        site.save()
-        errors = { 'errors': []}
+        # Save the site and link the category and url in a single transaction
+        try:
+            with transaction.atomic(), batch_changes():
+                site.save()
 
-        # Handle the url in the request
-        if 'url' in validated_data:
-            site.url.clear()
-            request_urls = validated_data.pop('url')
-            # Check if the request contains at least one url
-            if len(request_urls) == 0:
-                errors['errors'].append({'url': 'At least one URL is required'})
-            else:
-                self.handle_reference(site, SiteURL, request_urls)
-
-        # Handle the category in the request
-        if 'category' in validated_data:
-            site.category.clear()
-            request_categories = validated_data.pop('category')
-            # Check if the request contains at least one category
-            if len(request_categories) == 0:
-                errors['errors'].append({'category': 'At least one Category is required'})
-            else:
-                self.handle_reference(site, SiteCategory, request_categories)
+                if 'url' in validated_data:
+                    self.handle_reference(site, SiteURL, validated_data.pop('url'))
+
+                if 'category' in validated_data:
+                    self.handle_reference(site, SiteCategory, validated_data.pop('category'))
+        except IntegrityError as error:
+            if not violates_unique_name(error):
+                raise
+            # Another request created a site with the same name
+            raise serializers.ValidationError({'name': 'This name already exists'})
 
-        if len(errors['errors']) > 0:
-            # Delete the created site
-            site.delete()
-            raise serializers.ValidationError(errors)
-        
-        site.save()
         return site
 
+    # Update the fields passed in the request, the others are kept. Only the
+    # links to the urls and categories that changed are removed and added,
+    # and a request that changes nothing doesn't write or change the site
     def update(self, instance, validated_data):
 
-        if Sites.objects.filter(name=validated_data['name']).exists() and \
-            instance.name != validated_data['name']:
+        if 'name' in validated_data and instance.name != validated_data['name'] and \
+            Sites.objects.filter(name=validated_data['name']).exists():
             raise serializers.ValidationError({'name': 'This name already exists'})
 
-        instance.name = validated_data['name']
-        if 'active' in validated_data:
-            instance.active = validated_data['active']
-        instance.save()
-
-        errors = { 'errors': []}
-
-        if 'url' in validated_data:
-            request_urls = validated_data.pop('url')
-
-            # Check if the request contains at least one url
-            if len(request_urls) == 0:
-                errors['errors'].append({'url': 'At least one URL is required'})
-            else:
-                # Remove all urls related to this site before adding the
-                # urls passed in the request
-                instance.url.clear()
-                self.handle_reference(instance, SiteURL, request_urls)
-
-        if 'category' in validated_data:
-            request_categories = validated_data.pop('category')
-
-            # Check if the request contains at least one category
-            if len(request_categories) == 0:
-                errors['errors'].append({'category': 'At least one Category is required'})
-            else:
-                # Remove all categories related to this site before adding the
-                # categories passed in the request
-                instance.category.clear()
-                self.handle_reference(instance, SiteCategory, request_categories)
-
-        if len(errors['errors']) > 0:
-            raise serializers.ValidationError(errors)
-
-        instance.save()
+        self.validate_references(validated_data)
+
+        changed_fields = []
+        for field in ('name', 'active'):
+            if field in validated_data and getattr(instance, field) != validated_data[field]:
+                setattr(instance, field, validated_data[field])
+                changed_fields.append(field)
+
+        try:
+            with transaction.atomic(), batch_changes():
+                if changed_fields:
+                    instance.save(update_fields=changed_fields)
+
+                # set removes and adds only the links that differ, the
+                # receivers of the changes see just those
+                if 'url' in validated_data:
+                    instance.url.set(SiteURL.objects.resolve(
+                        data['description'] for data in validated_data.pop('url')
+                    ))
+
+                if 'category' in validated_data:
+                    instance.category.set(SiteCategory.objects.resolve(
+                        data['description'] for data in validated_data.pop('category')
+                    ))
+        except IntegrityError as error:
+            if not violates_unique_name(error):
+                raise
+            raise serializers.ValidationError({'name': 'This name already exists'})
 
-        return instance
\ No newline at end of file
+        return instance
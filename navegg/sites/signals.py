@@ -0,0 +1,162 @@
+import threading
+from contextlib import contextmanager
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+from sites import changes
+from sites.cache import get_cache
+from sites.index import get_index
+from sites.models import Sites, SiteCategory, SiteChange, SiteURL
+
+# Sent when sites or their urls and categories change, with the ids of the
+# changed sites in site_ids (None when any site could have changed) and the
+# action, one of the SiteChange actions. The model signals are translated to
+# it and the bulk writes, which don't send model signals, send it directly
+sites_changed = Signal()
+
+_batch = threading.local()
+
+# Inside this block the changes of the sites are collected and sent once at
+# the end, one per site, instead of once per save and per change of the urls
+# and categories. It should be used inside the transaction of the changes
+@contextmanager
+def batch_changes():
+    if getattr(_batch, 'actions', None) is not None:
+        # Already collecting the changes
+        yield
+        return
+
+    _batch.actions = {}
+    _batch.references = set()
+    try:
+        yield
+        actions, references = _batch.actions, _batch.references
+    finally:
+        _batch.actions = None
+        _batch.references = None
+
+    # The sites saved already had the version increased by the save
+    touch = [site_id for site_id in references if site_id not in actions]
+    if touch:
+        Sites.objects.filter(pk__in=touch).touch()
+    for site_id in touch:
+        actions[site_id] = SiteChange.UPDATED
+
+    by_action = {}
+    for site_id, action in actions.items():
+        by_action.setdefault(action, []).append(site_id)
+    for action, site_ids in by_action.items():
+        sites_changed.send(sender=Sites, site_ids=site_ids, action=action)
+
+def site_changed(site_id, action):
+    actions = getattr(_batch, 'actions', None)
+    if actions is None:
+        sites_changed.send(sender=Sites, site_ids=[site_id], action=action)
+    elif action == SiteChange.DELETED or actions.get(site_id) != SiteChange.CREATED:
+        # A site created in the batch is sent as created, unless deleted
+        actions[site_id] = action
+
+@receiver(post_save, sender=Sites)
+def site_saved(sender, instance, created, **kwargs):
+    if instance.deleted_at is not None:
+        # Soft deleted
+        site_changed(instance.pk, SiteChange.DELETED)
+    else:
+        site_changed(instance.pk, SiteChange.CREATED if created else SiteChange.UPDATED)
+
+# The sites soft deleted before were already sent when they were marked, and
+# are purged without sending them again
+@receiver(post_delete, sender=Sites)
+def site_deleted(sender, instance, **kwargs):
+    if instance.deleted_at is None:
+        site_changed(instance.pk, SiteChange.DELETED)
+
+# Return the ids of the sites linked to the url or category
+def linked_site_ids(reference):
+    through = Sites.url.through if isinstance(reference, SiteURL) else Sites.category.through
+    column = f'{reference._meta.model_name}_id'
+    return list(
+        through.objects.filter(**{column: reference.pk}).values_list('sites_id', flat=True)
+    )
+
+# The sites changed by the url or category side of the relation are increased
+# the version and sent as updated
+def references_changed(site_ids):
+    if not site_ids:
+        return
+    references = getattr(_batch, 'references', None)
+    if references is not None:
+        references.update(site_ids)
+        return
+    Sites.objects.filter(pk__in=site_ids).touch()
+    sites_changed.send(sender=Sites, site_ids=site_ids, action=SiteChange.UPDATED)
+
+@receiver(m2m_changed, sender=Sites.url.through)
+@receiver(m2m_changed, sender=Sites.category.through)
+def site_references_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # The sites linked to a url or category being cleared are only
+        # known before the clear
+        instance._linked_site_ids = linked_site_ids(instance)
+        return
+    if not action.startswith('post_'):
+        return
+
+    if not reverse:
+        if pk_set is not None and len(pk_set) == 0:
+            # Nothing was added or removed
+            return
+        references_changed([instance.pk])
+    elif pk_set is not None:
+        # The relation was changed from the url or category side
+        references_changed(list(pk_set))
+    else:
+        references_changed(instance.__dict__.pop('_linked_site_ids', []))
+
+# Changing or removing a url or category changes every site linked to it
+@receiver(post_save, sender=SiteURL)
+@receiver(post_save, sender=SiteCategory)
+def reference_saved(sender, instance, created, **kwargs):
+    if not created:
+        references_changed(linked_site_ids(instance))
+
+@receiver(pre_delete, sender=SiteURL)
+@receiver(pre_delete, sender=SiteCategory)
+def reference_deleting(sender, instance, **kwargs):
+    # The links are removed with the url or category
+    instance._linked_site_ids = linked_site_ids(instance)
+
+@receiver(post_delete, sender=SiteURL)
+@receiver(post_delete, sender=SiteCategory)
+def reference_deleted(sender, instance, **kwargs):
+    references_changed(instance.__dict__.pop('_linked_site_ids', []))
+
+# Remove the changed sites from the cache now, and again when the transaction
+# commits, so a request reading the sites before the commit can't leave the
+# old data in the cache
+@receiver(sites_changed)
+def invalidate_cache(sender, site_ids, **kwargs):
+    cache = get_cache()
+    if cache is None:
+        return
+    cache.invalidate(site_ids)
+    transaction.on_commit(lambda: cache.invalidate(site_ids))
+
+# Read the changed sites again on the next lookup of the index, now and when
+# the transaction commits, like the cache
+@receiver(sites_changed)
+def update_index(sender, site_ids, **kwargs):
+    index = get_index()
+    index.mark_stale(site_ids)
+    transaction.on_commit(lambda: index.mark_stale(site_ids))
+
+# Record the changes in the log of the change feed, in the same transaction
+# as the change itself
+@receiver(sites_changed)
+def record_changes(sender, site_ids, action, **kwargs):
+    if not site_ids:
+        return
+    SiteChange.objects.bulk_create(
+        [SiteChange(site_id=site_id, action=action) for site_id in site_ids]
+    )
+    transaction.on_commit(changes.notify)
@@ -0,0 +1,337 @@
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from sites.changes import log_head
+from sites.models import SiteCategoryLink, SiteURLLink
+from sites.normalize import normalize_url, url_candidates, url_host
+
+# Snapshot of the lookups of the index of the sites compiled to a binary file,
+# which every worker maps in memory read only instead of building its own
+# index from the database. The pages of the file are shared by the workers
+# and loaded by the system when they're read, so opening it takes the same
+# time whatever its size
+#
+# The file is a header, a table with the offset and length of each section
+# and the sections, aligned to 8 bytes:
+#
+# - a table of sorted strings for each kind of key (the categories, the urls,
+#   the hosts and the normalized urls), as the offsets of the strings and
+#   their UTF-8 bytes, with the CSR table of the ids of the active sites of
+#   each key: the offsets of the ids of each key and the ids
+# - the sorted ids of the active sites, with the CSR table of the indexes of
+#   their categories
+#
+# The snapshot is as up to date as its last build with `manage.py
+# build_snapshot`, which replaces the file atomically. The workers see the
+# new file on their next lookup
+
+MAGIC = b'NVGSITES'
+FORMAT_VERSION = 1
+
+# Magic, format version, byte order, number of sections, last change of the
+# log read, build time
+HEADER = struct.Struct('<8sIIIQd')
+SECTION = struct.Struct('<QQ')
+
+CATEGORY = 0
+URL = 1
+HOST = 2
+MATCH = 3
+
+KINDS = (CATEGORY, URL, HOST, MATCH)
+KEY_SECTIONS = ('key_offsets', 'key_data', 'site_offsets', 'site_ids')
+SECTIONS = len(KINDS) * len(KEY_SECTIONS) + 3
+BYTE_ORDER = 0 if sys.byteorder == 'little' else 1
+
+class SnapshotError(ValueError):
+    pass
+
+# The arrays of 32 bit integers, checked to be that size on this platform
+def uint32_array(values=()):
+    values = array('I', values)
+    assert values.itemsize == 4
+    return values
+
+def int32_array(values=()):
+    values = array('i', values)
+    assert values.itemsize == 4
+    return values
+
+# Return the sections of a table of the sorted keys with the ids of their sites
+def key_sections(site_ids_by_key):
+    keys = sorted(site_ids_by_key)
+    key_offsets = uint32_array([0])
+    key_data = bytearray()
+    site_offsets = uint32_array([0])
+    site_ids = int32_array()
+    for key in keys:
+        key_data += key.encode()
+        key_offsets.append(len(key_data))
+        site_ids.extend(sorted(site_ids_by_key[key]))
+        site_offsets.append(len(site_ids))
+    return [key_offsets, key_data, site_offsets, site_ids]
+
+# Compile the urls and categories of the active sites to the snapshot file
+# at path, replacing it atomically. Return the number of sites
+def build_snapshot(path):
+    # Read the log first, like the index, a change made during the build is
+    # in the next one
+    last_change = log_head()
+
+    by_kind = tuple({} for _ in KINDS)
+    site_categories = {}
+    for description, site_id in SiteCategoryLink.objects.active().values_list(
+        'sitecategory__description', 'sites_id'
+    ):
+        by_kind[CATEGORY].setdefault(description, set()).add(site_id)
+        site_categories.setdefault(site_id, set()).add(description)
+    for description, host, site_id in SiteURLLink.objects.active().values_list(
+        'siteurl__description', 'siteurl__host', 'sites_id'
+    ):
+        by_kind[URL].setdefault(description, set()).add(site_id)
+        by_kind[HOST].setdefault(host, set()).add(site_id)
+        site_categories.setdefault(site_id, set())
+        normalized = normalize_url(description)
+        if normalized:
+            by_kind[MATCH].setdefault(normalized, set()).add(site_id)
+
+    sections = []
+    for kind in KINDS:
+        sections.extend(key_sections(by_kind[kind]))
+
+    # The categories of each site as indexes in the sorted categories
+    category_index = {key: index for index, key in enumerate(sorted(by_kind[CATEGORY]))}
+    site_ids = int32_array(sorted(site_categories))
+    category_offsets = uint32_array([0])
+    categories = uint32_array()
+    for site_id in site_ids:
+        categories.extend(sorted(category_index[key] for key in site_categories[site_id]))
+        category_offsets.append(len(categories))
+    sections.extend([site_ids, category_offsets, categories])
+
+    for section in sections:
+        if isinstance(section, bytearray) and len(section) > 0xFFFFFFFF:
+            raise SnapshotError('The strings of the snapshot are larger than 4 GB')
+
+    write_snapshot(path, last_change, sections)
+    return len(site_ids)
+
+def align(offset):
+    return (offset + 7) & ~7
+
+def write_snapshot(path, last_change, sections):
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, BYTE_ORDER, len(sections), last_change, time.time())
+    offset = align(HEADER.size + SECTION.size * len(sections))
+    table = []
+    for section in sections:
+        length = len(section) * (section.itemsize if isinstance(section, array) else 1)
+        table.append((offset, length))
+        offset = align(offset + length)
+
+    # The file is written next to the old one and renamed over it, a worker
+    # opening it sees the old or the new snapshot, never a partial one
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+    try:
+        with os.fdopen(descriptor, 'wb') as output:
+            output.write(header)
+            for section_offset, length in table:
+                output.write(SECTION.pack(section_offset, length))
+            for section, (section_offset, _) in zip(sections, table):
+                output.write(b'\0' * (section_offset - output.tell()))
+                output.write(section)
+            output.flush()
+            os.fsync(output.fileno())
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+# Sorted strings of a snapshot, searched with bisect without decoding them
+class StringTable:
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return bytes(self.data[self.offsets[index]:self.offsets[index + 1]])
+
+    # Return the index of the string, or -1
+    def find(self, key):
+        index = bisect_left(self, key)
+        if index < len(self) and self[index] == key:
+            return index
+        return -1
+
+# A snapshot file mapped in memory, answering the lookups of the index
+class Snapshot:
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as snapshot_file:
+            self.stat = os.fstat(snapshot_file.fileno())
+            try:
+                self.mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError(f'{path} is not a snapshot of the sites')
+        buffer = memoryview(self.mmap)
+
+        if len(buffer) < HEADER.size:
+            raise SnapshotError(f'{path} is not a snapshot of the sites')
+        magic, version, byte_order, count, self.last_change, self.built_at = HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise SnapshotError(f'{path} is not a snapshot of the sites')
+        if version != FORMAT_VERSION or byte_order != BYTE_ORDER or count != SECTIONS:
+            raise SnapshotError(f'{path} was built by another version or platform, build it again')
+
+        # The sections are views of the mapped file, nothing is copied
+        sections = []
+        for index in range(count):
+            offset, length = SECTION.unpack_from(buffer, HEADER.size + SECTION.size * index)
+            if offset + length > len(buffer):
+                raise SnapshotError(f'{path} is truncated')
+            sections.append(buffer[offset:offset + length])
+
+        self.keys = []
+        self.key_sites = []
+        for kind in KINDS:
+            key_offsets, key_data, site_offsets, site_ids = sections[kind * 4:kind * 4 + 4]
+            self.keys.append(StringTable(key_offsets.cast('I'), key_data))
+            self.key_sites.append((site_offsets.cast('I'), site_ids.cast('i')))
+        site_ids, category_offsets, categories = sections[len(KINDS) * 4:]
+        self.site_ids = site_ids.cast('i')
+        self.site_categories = (category_offsets.cast('I'), categories.cast('I'))
+
+    # True when the file at the path isn't the one mapped
+    def replaced(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return (stat.st_ino, stat.st_dev, stat.st_mtime_ns, stat.st_size) != (
+            self.stat.st_ino, self.stat.st_dev, self.stat.st_mtime_ns, self.stat.st_size
+        )
+
+    def sites_of(self, kind, index):
+        offsets, site_ids = self.key_sites[kind]
+        return site_ids[offsets[index]:offsets[index + 1]]
+
+    # Return the number of active sites with the key and the ids of up to
+    # limit of them after the cursor, in id order, like SitesIndex.lookup
+    def lookup(self, kind, key, cursor=0, limit=None):
+        index = self.keys[kind].find(key.encode())
+        if index < 0:
+            return 0, []
+        ids = self.sites_of(kind, index)
+        start = bisect_right(ids, cursor)
+        end = len(ids) if limit is None else start + limit
+        return len(ids), ids[start:end].tolist()
+
+    def category(self, description, cursor=0, limit=None):
+        return self.lookup(CATEGORY, description, cursor, limit)
+
+    def url(self, description, cursor=0, limit=None):
+        return self.lookup(URL, description, cursor, limit)
+
+    def host(self, host, cursor=0, limit=None):
+        return self.lookup(HOST, url_host(host), cursor, limit)
+
+    # Return the index of the longest normalized url of the sites the url is
+    # under, or -1
+    def match(self, url):
+        for candidate in url_candidates(url):
+            index = self.keys[MATCH].find(candidate.encode())
+            if index >= 0:
+                return index
+        return -1
+
+    # Return the classification of each url, like SitesIndex.classify
+    def classify(self, urls):
+        by_url = {}
+        results = []
+        for url in urls:
+            result = by_url.get(url)
+            if result is None:
+                result = by_url[url] = self.match_result(self.match(url))
+            results.append(result)
+        return results
+
+    def match_result(self, index):
+        if index < 0:
+            return {'match': None, 'sites': [], 'categories': []}
+        site_ids = self.sites_of(MATCH, index).tolist()
+        offsets, categories = self.site_categories
+        category_indexes = set()
+        for site_id in site_ids:
+            row = bisect_left(self.site_ids, site_id)
+            category_indexes.update(categories[offsets[row]:offsets[row + 1]].tolist())
+        return {
+            'match': self.keys[MATCH][index].decode(),
+            'sites': site_ids,
+            'categories': [
+                self.keys[CATEGORY][category].decode() for category in sorted(category_indexes)
+            ],
+        }
+
+    def stats(self):
+        return {
+            'snapshot': self.path,
+            'built_at': self.built_at,
+            'last_change': self.last_change,
+            'size': len(self.mmap),
+            'sites': len(self.site_ids),
+            'categories': len(self.keys[CATEGORY]),
+            'urls': len(self.keys[URL]),
+            'hosts': len(self.keys[HOST]),
+        }
+
+logger = logging.getLogger('sites.snapshot')
+
+_snapshot = None
+_lock = threading.Lock()
+
+# Return the snapshot of SITES_SNAPSHOT_PATH, or None when it isn't set or the
+# file wasn't built yet or can't be read, and the index in memory answers. A
+# new file at the path replaces the mapped one on the next call, the requests
+# using the old one keep it until they end
+def get_snapshot():
+    global _snapshot
+    path = getattr(settings, 'SITES_SNAPSHOT_PATH', None)
+    if not path:
+        return None
+    snapshot = _snapshot
+    if snapshot is not None and not snapshot.replaced():
+        return snapshot
+    with _lock:
+        if _snapshot is None or _snapshot.replaced():
+            try:
+                _snapshot = Snapshot(path)
+            except FileNotFoundError:
+                return None
+            except SnapshotError as exc:
+                _snapshot = None
+                logger.warning('%s, the index in memory is used', exc)
+                return None
+        return _snapshot
+
+@receiver(setting_changed)
+def reset_snapshot(setting, **kwargs):
+    global _snapshot
+    if setting == 'SITES_SNAPSHOT_PATH':
+        _snapshot = None
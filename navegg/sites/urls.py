@@ -6,6 +6,13 @@ app_name = 'sites'
 urlpatterns = [
     path('', views.SitesList.as_view()),
     path('<int:pk>', views.SitesDetail.as_view()),
+    path('bulk/', views.SitesBulk.as_view()),
+    path('cache/', views.SitesCacheStats.as_view()),
+    path('changes', views.SitesChanges.as_view()),
+    path('index/', views.SitesIndexStats.as_view()),
+    path('index/category/<path:key>', views.SitesIndexLookup.as_view(lookup='category')),
+    path('index/host/<str:key>', views.SitesIndexLookup.as_view(lookup='host')),
+    path('index/url', views.SitesIndexLookup.as_view(lookup='url')),
 ]
 
 urlpatterns = format_suffix_patterns(urlpatterns)
\ No newline at end of file
@@ -1,18 +1,246 @@
 from django.shortcuts import render
-from django.http import Http404
-from sites.models import Sites, SiteURL, SiteCategory
+import hashlib
+from operator import itemgetter
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from django.views.decorators.csrf import csrf_exempt
+from sites.bulk import SitesBulkOperations
+from django.conf import settings
+from sites.cache import MISS, get_cache
+from sites.changes import decode_token, encode_token, log_expired, log_head, wait_for_changes
+from sites.filters import filter_sites
+from sites.index import get_index
+from sites.metrics import registry
+from sites.models import Sites, SiteURL, SiteCategory, SiteChange
+from sites.pagination import SitesKeysetPagination, get_int_param, iterate_chunks
+from sites.renderers import ColumnarRenderer, MessagePackRenderer, encode_json, msgpack
+from sites.representation import SITE_FIELDS, represent_queryset, represent_sites
 from sites.serializers import SitesSerializer
+from sites.snapshot import get_snapshot
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
-class SitesList(APIView):
+# Return a 304 (Not Modified) response when the ETag or the Last-Modified
+# date in the request headers match the current ones, or None
+def not_modified(request, etag, last_modified):
+    response = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        response['ETag'] = etag
+    return response
 
-    # Return list of all sites
+# Add the ETag and Last-Modified headers to the response
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+def site_last_modified(site):
+    return int(site.updated_at.timestamp())
+
+# The ETag of a page changes when any of its sites or the next page changes.
+# The pages have no Last-Modified: a site deleted or moved out of the page
+# leaves the times of the others as they were
+def page_etag(page, next_cursor):
+    key = ','.join(site.etag for site in page) + f';{next_cursor}'
+    return f'"{hashlib.sha256(key.encode()).hexdigest()[:32]}"'
+
+# The ETag of the representation of the data in the format of the response,
+# the JSON one is kept as it is
+def format_etag(request, etag):
+    renderer_format = request.accepted_renderer.format
+    if renderer_format == 'json':
+        return etag
+    return f'{etag[:-1]}-{renderer_format}"'
+
+# Async reads of the views for the ASGI application (navegg/asgi_urls.py).
+# as_async_view returns an async view answering GET and HEAD with the aget
+# method of the view in the event loop, and the other methods with the DRF
+# view in the thread of the database. The reads use the content negotiation,
+# exception handling and rendering of DRF, but not its authentication, which
+# reads the session from the database: like the DRF views with the default
+# permissions, they're answered to anyone
+class AsyncReadMixin:
+
+    @classmethod
+    def as_async_view(cls, **initkwargs):
+        sync_view = cls.as_view(**initkwargs)
+
+        async def view(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await sync_to_async(sync_view)(request, *args, **kwargs)
+            self = cls(**initkwargs)
+            self.setup(request, *args, **kwargs)
+            return await self.async_dispatch(request, *args, **kwargs)
+
+        view.view_class = cls
+        view.view_initkwargs = initkwargs
+        # The DRF views check the CSRF token themselves when authenticating
+        return csrf_exempt(view)
+
+    async def async_dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            self.format_kwarg = self.get_format_suffix(**kwargs)
+            request.accepted_renderer, request.accepted_media_type = (
+                self.perform_content_negotiation(request)
+            )
+            response = await self.aget(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        # Rendered in the event loop, but for the HTML of the browsable API,
+        # which reads the user, rendered by the handler in a thread
+        if isinstance(self.response, Response) and not isinstance(
+            request.accepted_renderer, BrowsableAPIRenderer
+        ):
+            self.response.render()
+        return self.response
+
+# Call the method of the cache, in the event loop when the cache is in the
+# memory of the process and the call doesn't read the change log, and in the
+# thread of the database otherwise
+async def call_cache(cache, method, *args):
+    if cache.in_memory and not cache.check_due():
+        return method(*args)
+    return await sync_to_async(method)(*args)
+
+# The bytes of a chunk of the stream of sites, the first one of a JSON array
+# without the comma before it
+def encode_stream_chunk(data, first, ndjson):
+    if ndjson:
+        return b''.join(encode_json(site, newline=True) for site in data)
+    # The sites of the chunk without the brackets of the list
+    return (b'' if first else b',') + encode_json(data)[1:-1]
+
+class SitesList(AsyncReadMixin, APIView):
+    pagination_class = SitesKeysetPagination
+    # The lists of sites can also be fetched in MessagePack, when the msgpack
+    # package is installed, and in columns, with ?format=msgpack and
+    # ?format=columnar or the Accept header
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + (
+        [MessagePackRenderer] if msgpack is not None else []
+    ) + [ColumnarRenderer]
+
+    # Return one page of sites, or every site when streaming, filtered by
+    # the query parameters
     def get(self, request, format=None):
-        sites = Sites.objects.all()
-        serializer = SitesSerializer(sites, many=True)
-        return Response(serializer.data)
+        sites = filter_sites(Sites.objects.all(), request)
+        paginator = self.pagination_class()
+
+        stream = request.query_params.get('stream')
+        if stream in ('1', 'true', 'ndjson'):
+            return self.stream(sites, paginator, request, ndjson=stream == 'ndjson')
+
+        # The pages are cached by their query parameters
+        cache = get_cache()
+        params = request.query_params.dict()
+        generation, cached = cache.get_list(params) if cache is not None else (None, MISS)
+        if cached is MISS:
+            cached = self.read_page(request, sites, paginator)
+            if isinstance(cached, HttpResponse):
+                return cached
+            if cache is not None:
+                cache.set_list(params, generation, cached)
+        return self.page_response(request, paginator, cached)
+
+    # The get of the ASGI application, with the query and the representation
+    # in the thread of the database
+    async def aget(self, request, format=None):
+        sites = filter_sites(Sites.objects.all(), request)
+        paginator = self.pagination_class()
+
+        stream = request.query_params.get('stream')
+        if stream in ('1', 'true', 'ndjson'):
+            return self.async_stream(sites, paginator, request, ndjson=stream == 'ndjson')
+
+        cache = get_cache()
+        params = request.query_params.dict()
+        generation, cached = (
+            await call_cache(cache, cache.get_list, params) if cache is not None else (None, MISS)
+        )
+        if cached is MISS:
+            cached = await sync_to_async(self.read_page)(request, sites, paginator)
+            if isinstance(cached, HttpResponse):
+                return cached
+            if cache is not None:
+                await call_cache(cache, cache.set_list, params, generation, cached)
+        return self.page_response(request, paginator, cached)
+
+    # Read the page of the sites and return its data, next cursor and ETag,
+    # or the 304 response without loading the urls and categories when the
+    # client already has the page
+    def read_page(self, request, sites, paginator):
+        page = paginator.paginate_queryset(sites, request)
+        etag = page_etag(page, paginator.next_cursor)
+        response = not_modified(request, format_etag(request, etag), None)
+        if response is not None:
+            return response
+        data = represent_sites((site.id, site.name, site.active) for site in page)
+        return (data, paginator.next_cursor, etag)
+
+    def page_response(self, request, paginator, cached):
+        data, paginator.next_cursor, etag = cached
+        paginator.request = request
+        response = not_modified(request, format_etag(request, etag), None)
+        if response is not None:
+            return response
+        response = paginator.get_paginated_response(data)
+        patch_vary_headers(response, ['Accept'])
+        return set_validators(response, format_etag(request, etag), None)
+
+    # The representation of the sites, chunk by chunk
+    def stream_chunks(self, sites, paginator, request):
+        cursor = paginator.get_cursor(request)
+        chunk_size = paginator.get_page_size(request)
+        rows = sites.values_list(*SITE_FIELDS)
+        return (
+            represent_sites(chunk)
+            for chunk in iterate_chunks(rows, chunk_size, cursor, get_id=itemgetter(0))
+        )
+
+    # Stream the sites as a JSON array (or one JSON object per line) built
+    # chunk by chunk, so only one chunk of sites is in memory at a time
+    def stream(self, sites, paginator, request, ndjson=False):
+        chunks = self.stream_chunks(sites, paginator, request)
+
+        def generate():
+            if not ndjson:
+                yield b'['
+            for index, data in enumerate(chunks):
+                yield encode_stream_chunk(data, index == 0, ndjson)
+            if not ndjson:
+                yield b']'
+
+        content_type = 'application/x-ndjson' if ndjson else 'application/json'
+        return StreamingHttpResponse(generate(), content_type=content_type)
+
+    # Stream the sites like stream, reading each chunk in the thread of the
+    # database and sending it from the event loop
+    def async_stream(self, sites, paginator, request, ndjson=False):
+        chunks = self.stream_chunks(sites, paginator, request)
+
+        async def generate():
+            if not ndjson:
+                yield b'['
+            first = True
+            while (data := await sync_to_async(next)(chunks, None)) is not None:
+                yield encode_stream_chunk(data, first, ndjson)
+                first = False
+            if not ndjson:
+                yield b']'
+
+        content_type = 'application/x-ndjson' if ndjson else 'application/json'
+        return StreamingHttpResponse(generate(), content_type=content_type)
 
     # Create a new site
     def post(self, request, format=None):
@@ -22,7 +250,7 @@ class SitesList(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class SitesDetail(APIView):
+class SitesDetail(AsyncReadMixin, APIView):
 
     # Return site with passed id
     def get_object(self, pk):
@@ -33,14 +261,53 @@ class SitesDetail(APIView):
 
     # Request to get site with id
     def get(self, request, pk, format=None):
-        site = self.get_object(pk)
-        serializer = SitesSerializer(site)
-        return Response(serializer.data)
+        cache = get_cache()
+        cached = cache.get_site(pk) if cache is not None else MISS
+        if cached is MISS:
+            cached = self.read_site(request, self.get_object(pk))
+            if isinstance(cached, HttpResponse):
+                return cached
+            if cache is not None:
+                cache.set_site(pk, cached)
+        return self.site_response(request, cached)
+
+    # The get of the ASGI application, the site is read with the async ORM
+    # and represented in the thread of the database
+    async def aget(self, request, pk, format=None):
+        cache = get_cache()
+        cached = await call_cache(cache, cache.get_site, pk) if cache is not None else MISS
+        if cached is MISS:
+            site = await Sites.objects.filter(pk=pk).afirst()
+            if site is None:
+                raise Http404
+            cached = await sync_to_async(self.read_site)(request, site)
+            if isinstance(cached, HttpResponse):
+                return cached
+            if cache is not None:
+                await call_cache(cache, cache.set_site, pk, cached)
+        return self.site_response(request, cached)
+
+    # Return the data and validators of the site, or the 304 response without
+    # loading the urls and categories when the client already has the site
+    def read_site(self, request, site):
+        etag, last_modified = site.etag, site_last_modified(site)
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        return (represent_sites([(site.id, site.name, site.active)])[0], etag, last_modified)
+
+    def site_response(self, request, cached):
+        data, etag, last_modified = cached
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        return set_validators(Response(data), etag, last_modified)
 
     # Request to update site with id
     def patch(self, request, pk, format=None):
         site = self.get_object(pk)
-        serializer = SitesSerializer(site, data=request.data)
+        # Only the fields in the request are changed
+        serializer = SitesSerializer(site, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data)
@@ -49,5 +316,150 @@ class SitesDetail(APIView):
     # Request to delete site with id
     def delete(self, request, pk, format=None):
         site = self.get_object(pk)
-        site.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+        # The site is only marked as deleted by default, its row and links
+        # are removed later by `manage.py purge_sites`
+        if getattr(settings, 'SITES_SOFT_DELETE', True):
+            site.soft_delete()
+        else:
+            site.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class SitesBulk(APIView):
+
+    # Apply a list of create, patch and delete operations in one transaction
+    def post(self, request, format=None):
+        bulk = SitesBulkOperations(request.data)
+        if bulk.is_valid():
+            bulk.save()
+            return Response(bulk.data)
+        return Response(bulk.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class SitesCacheStats(APIView):
+
+    # Return the hit and miss counters of the cache of this process
+    def get(self, request, format=None):
+        cache = get_cache()
+        if cache is None:
+            return Response({'enabled': False})
+        return Response({'enabled': True, **cache.stats()})
+
+
+class SitesChanges(APIView):
+
+    # Return the changes of the sites after the token passed in since, or
+    # since the beginning of the log. With wait, the request waits up to that
+    # many seconds for a change when there are none. A token older than the
+    # log kept by prune_changes is answered with 410
+    def get(self, request, format=None):
+        since = request.query_params.get('since')
+        change_id = 0
+        if since:
+            change_id = decode_token(since)
+            if change_id is None:
+                return Response({'since': 'Invalid token'}, status=status.HTTP_400_BAD_REQUEST)
+
+        max_limit = getattr(settings, 'SITES_CHANGES_PAGE_SIZE', 1000)
+        limit = min(get_int_param(request, 'limit', max_limit), max_limit) or max_limit
+        wait = min(get_int_param(request, 'wait', 0), getattr(settings, 'SITES_CHANGES_MAX_WAIT', 30))
+        rows, watermark = wait_for_changes(change_id, limit, wait)
+        # The changes after the token were pruned from the log, the client
+        # reads the sites again and follows the feed from next
+        if since and (not rows or rows[0][0] > change_id + 1) and log_expired(change_id):
+            return Response({
+                'since': 'The token is older than the log of changes, read the sites again',
+                'next': encode_token(log_head()),
+            }, status=status.HTTP_410_GONE)
+
+        # Only the last change of each site matters, with its current data
+        actions = {}
+        for _, site_id, action in rows:
+            actions.pop(site_id, None)
+            actions[site_id] = action
+        sites = Sites.objects.filter(
+            id__in=[site_id for site_id, action in actions.items() if action != SiteChange.DELETED]
+        )
+        data = {site['id']: site for site in represent_queryset(sites)}
+
+        changes = []
+        for site_id, action in actions.items():
+            if site_id not in data:
+                # Deleted after the change
+                action = SiteChange.DELETED
+            changes.append({'id': site_id, 'action': action, 'data': data.get(site_id)})
+
+        return Response({
+            'changes': changes,
+            'next': encode_token(watermark),
+            'more': len(rows) == limit,
+        })
+
+
+# The snapshot of the sites when there's one, else the index of the process
+def get_lookups():
+    snapshot = get_snapshot()
+    return snapshot if snapshot is not None else get_index()
+
+class SitesIndexLookup(APIView):
+    # The lookup of the index answered by the view: category, host or url
+    lookup = None
+
+    # Return the ids of the active sites with the category, a url on the
+    # host or the url, from the snapshot or the index in memory. The url is
+    # passed in ?url=
+    def get(self, request, key=None, format=None):
+        if self.lookup == 'url':
+            key = request.query_params.get('url')
+            if not key:
+                return Response({'url': 'This field is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        cursor = get_int_param(request, 'cursor', 0)
+        limit = get_int_param(request, 'limit', 0) or None
+        # Read one extra id to know if there are more
+        count, site_ids = getattr(get_lookups(), self.lookup)(
+            key, cursor, limit + 1 if limit is not None else None
+        )
+
+        next_cursor = None
+        if limit is not None and len(site_ids) > limit:
+            site_ids = site_ids[:limit]
+            next_cursor = site_ids[-1]
+        return Response({'count': count, 'sites': site_ids, 'next': next_cursor})
+
+class SitesIndexStats(APIView):
+
+    # Return the size of the snapshot or of the index of this process
+    def get(self, request, format=None):
+        return Response(get_lookups().stats())
+
+class SitesClassify(APIView):
+
+    # Return the site of a visited url, passed as {"url": ...}, or of many
+    # urls, passed as {"urls": [...]}: the longest url of the sites it's under
+    # with the ids of the active sites and their categories, from the
+    # snapshot or the index
+    def post(self, request, format=None):
+        data = request.data
+        single = isinstance(data, dict) and 'url' in data
+        urls = [data['url']] if single else data.get('urls') if isinstance(data, dict) else None
+
+        max_urls = getattr(settings, 'SITES_CLASSIFY_MAX_URLS', 10000)
+        if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+            field = 'url' if single else 'urls'
+            return Response({field: 'Expected a url or a list of urls'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(urls) > max_urls:
+            return Response({'urls': f'At most {max_urls} urls are allowed'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        results = [
+            {'url': url, **result} for url, result in zip(urls, get_lookups().classify(urls))
+        ]
+        return Response(results[0] if single else {'results': results})
+
+# Metrics of the requests answered by this process, in the text format of
+# Prometheus, see sites.metrics
+def metrics(request):
+    return HttpResponse(
+        registry.export(), content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
@@ -0,0 +1,26 @@
+#!/bin/sh
+# Run the tests on a throwaway PostgreSQL server in a temporary directory,
+# once with the connections kept by Django and once with the pool of
+# psycopg. initdb and pg_ctl are taken from PG_BIN, by default the bindir
+# of pg_config or the PATH; initdb doesn't run as root. The arguments are
+# passed to manage.py test
+#   ./test_postgres.sh [sites.tests.SiteBulkTestCase ...]
+set -eu
+cd "$(dirname "$0")"
+
+if [ -z "${PG_BIN:-}" ]; then
+    PG_BIN=$(pg_config --bindir 2>/dev/null || dirname "$(command -v initdb)")
+fi
+PORT=${PG_PORT:-55432}
+DIRECTORY=$(mktemp -d)
+trap '"$PG_BIN/pg_ctl" -D "$DIRECTORY/data" -m immediate stop >/dev/null 2>&1 || true; rm -rf "$DIRECTORY"' EXIT
+
+"$PG_BIN/initdb" -D "$DIRECTORY/data" -U navegg --auth=trust >/dev/null
+# Only the socket in the directory, nothing listens on the network
+"$PG_BIN/pg_ctl" -D "$DIRECTORY/data" -l "$DIRECTORY/server.log" -w \
+    -o "-p $PORT -k $DIRECTORY -c listen_addresses=''" start >/dev/null
+
+export DATABASE_ENGINE=postgresql DATABASE_NAME=postgres DATABASE_USER=navegg \
+    DATABASE_HOST="$DIRECTORY" DATABASE_PORT="$PORT"
+python manage.py test --noinput "$@"
+DATABASE_POOL=1 python manage.py test --noinput "$@"